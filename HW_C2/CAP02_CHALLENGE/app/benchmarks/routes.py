@@ -0,0 +1,165 @@
+"""
+Latency and throughput of every route in tasks_router.py.
+
+Run from the `app` folder:
+
+    python -m benchmarks.routes
+    python -m benchmarks.routes --sizes 10000 --concurrency 1 32 --profile
+    python -m benchmarks.routes --json results.json
+
+For each store size the in-process store is truncated and seeded with that
+many tasks, then each route is driven through the ASGI app with
+`httpx.AsyncClient`, keeping `concurrency` requests in flight until
+`--requests` have completed. Percentiles and req/s are printed per route;
+`--json` saves them so two store implementations can be compared.
+
+`--profile` runs each route again for a quarter of the requests under
+cProfile and prints the functions with the most own time. For a flame graph, run the whole
+harness under py-spy instead:
+
+    py-spy record -o profile.svg -- python -m benchmarks.routes --sizes 100000
+
+The ASGI test transport waits for the app to finish, so DELETE /tasks/
+includes the background reclaim that a real server runs after responding,
+and GET /tasks/changes, a long-lived stream, is left out.
+"""
+import argparse
+import asyncio
+import cProfile
+import io
+import json
+import pstats
+import random
+import time
+from typing import Awaitable, Callable, Dict, List
+
+import httpx
+
+from db import db
+from main import app
+from models import Task
+
+SEED = 1234
+
+
+def percentile(values: List[float], q: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def seed_store(size: int):
+    db.delete_all_tasks()
+    asyncio.run(db.reclaim())
+    rng = random.Random(SEED)
+    for i in range(size):
+        db.add_task(Task(title=f"task {i}", description=f"description {i}" if i % 2 else None, completed=rng.random() < 0.3))
+
+
+def make_routes(size: int, rng: random.Random) -> Dict[str, Callable[[httpx.AsyncClient], Awaitable[httpx.Response]]]:
+    """Requests for every route, in an order that keeps the store valid: deletes go last."""
+    first_id = db.get_tasks(0, 1)[0].id
+    task_ids = lambda: first_id + rng.randrange(size)
+    # Conditional reads revisit a small pool of ids, so fetching their ETags
+    # once costs little next to the 304s being measured.
+    cached_ids = [task_ids() for _ in range(32)]
+    etags = {}
+
+    async def get_cached(client, url):
+        if url not in etags:
+            etags[url] = (await client.get(url)).headers["etag"]
+        return await client.get(url, headers={"If-None-Match": etags[url]})
+
+    deleted = iter(range(first_id + size - 1, first_id - 1, -1))
+
+    return {
+        "GET /": lambda client: client.get("/"),
+        "POST /tasks/": lambda client: client.post("/tasks/", json={"title": "new task"}),
+        "GET /tasks/{id}": lambda client: client.get(f"/tasks/{task_ids()}"),
+        "GET /tasks/{id} 304": lambda client: get_cached(client, f"/tasks/{rng.choice(cached_ids)}"),
+        "GET /tasks/": lambda client: client.get("/tasks/", params={"skip": rng.randrange(size), "limit": 100}),
+        "GET /tasks/ first page": lambda client: client.get("/tasks/", params={"limit": 100}),
+        "GET /tasks/ 304": lambda client: get_cached(client, "/tasks/?limit=100"),
+        "PUT /tasks/{id}": lambda client: client.put(f"/tasks/{task_ids()}", json={"completed": True}),
+        "GET /tasks/stats": lambda client: client.get("/tasks/stats"),
+        "DELETE /tasks/{id}": lambda client: client.delete(f"/tasks/{next(deleted)}"),
+        "DELETE /tasks/": lambda client: client.delete("/tasks/", params={"confirm": "true"}),
+    }
+
+
+async def drive(client: httpx.AsyncClient, request, requests: int, concurrency: int) -> dict:
+    latencies: List[float] = []
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            response = await request(client)
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code < 400, f"{response.status_code}: {response.text}"
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def profile(client: httpx.AsyncClient, request, requests: int, top: int) -> str:
+    profiler = cProfile.Profile()
+    profiler.enable()
+    asyncio.run(drive(client, request, requests, 1))
+    profiler.disable()
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("tottime").print_stats(top)
+    return out.getvalue()
+
+
+def run_size(size: int, args) -> List[dict]:
+    results = []
+    for concurrency in args.concurrency:
+        start = time.perf_counter()
+        seed_store(size)
+        print(f"\n{size:,} tasks (seeded in {time.perf_counter() - start:.1f}s), concurrency {concurrency}")
+        print(f"{'route':<24}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        rng = random.Random(SEED)
+        routes = make_routes(size, rng)
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+        for route, request in routes.items():
+            requests = 1 if route == "DELETE /tasks/" else min(args.requests, size)
+            stats = asyncio.run(drive(client, request, requests, min(concurrency, requests)))
+            results.append({"size": size, "concurrency": concurrency, "route": route, **stats})
+            print(f"{route:<24}{stats['rps']:>10,.0f}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+            if args.profile and route != "DELETE /tasks/":
+                print(profile(client, request, max(min(args.requests, size) // 4, 1), args.profile_top))
+        asyncio.run(db.reclaim())
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 32, 256])
+    parser.add_argument("--requests", type=int, default=2000, help="requests per route")
+    parser.add_argument("--profile", action="store_true", help="print a cProfile summary per route")
+    parser.add_argument("--profile-top", type=int, default=15)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        results += run_size(size, args)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Memory benchmark: bytes per task of the columnar `FakeDB` against a dict of
+pydantic `Task` models, which is how the store kept tasks before.
+
+Run from the `app` folder:
+
+    python -m benchmarks.store_memory --tasks 1000000 --distinct-titles 1000
+
+Titles cycle through `--distinct-titles` values (pass 0 for all unique) and
+every other task has a description.
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+from db import FakeDB
+from models import Task
+
+
+def make_task(i: int, distinct_titles: int) -> Task:
+    title = f"task {i % distinct_titles if distinct_titles else i}"
+    description = f"description of task {i}" if i % 2 else None
+    return Task(title=title, description=description, completed=i % 3 == 0)
+
+
+def measure(label: str, tasks: int, build):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    store = build()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<12}: {used / tasks:8.1f} bytes/task  {used / 2**20:9.1f} MiB  built in {elapsed:.2f}s")
+    return store
+
+
+def build_models(tasks: int, distinct_titles: int):
+    store = {}
+    for i in range(tasks):
+        task = make_task(i, distinct_titles)
+        task.id = i + 1
+        store[task.id] = task
+    return store
+
+
+def build_columns(tasks: int, distinct_titles: int):
+    store = FakeDB()
+    for i in range(tasks):
+        store.add_task(make_task(i, distinct_titles))
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=200_000)
+    parser.add_argument("--distinct-titles", type=int, default=1000)
+    args = parser.parse_args()
+
+    measure("pydantic", args.tasks, lambda: build_models(args.tasks, args.distinct_titles))
+    measure("columnar", args.tasks, lambda: build_columns(args.tasks, args.distinct_titles))
+
+
+if __name__ == "__main__":
+    main()
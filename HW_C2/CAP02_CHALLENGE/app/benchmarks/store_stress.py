@@ -0,0 +1,107 @@
+"""
+Stress benchmark for the task store under concurrent writers.
+
+Run from the `app` folder:
+
+    python -m benchmarks.store_stress --threads 8 --ops 20000 --concurrency 200
+
+Two phases are measured:
+
+- threads: N OS threads create, update and delete tasks directly on a fresh `FakeDB`.
+- requests: the FastAPI app is driven in-process with `httpx.AsyncClient`,
+  keeping `--concurrency` requests in flight.
+
+After each phase the store is checked for duplicate ids and lost writes.
+"""
+import argparse
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from db import FakeDB
+from models import Task, UpdateTaskModel
+
+
+def check_store(store: FakeDB, expected: int):
+    columns = store.columns
+    ids = [task_id for task_id, alive in zip(columns.ids, columns.alive) if alive]
+    assert all(a < b for a, b in zip(columns.ids, columns.ids[1:])), "duplicate or unordered task ids"
+    assert len(ids) == len(store) == expected, f"expected {expected} tasks, found {len(ids)}"
+
+
+def worker(store: FakeDB, ops: int, seed: int):
+    rng = random.Random(seed)
+    created = []
+    deleted = 0
+    for i in range(ops):
+        task = store.add_task(Task(title=f"task {seed}-{i}"))
+        created.append(task.id)
+        roll = rng.random()
+        if roll < 0.3:
+            store.update_task(rng.choice(created), UpdateTaskModel(completed=True))
+        elif roll < 0.4:
+            if store.delete_task(created.pop(rng.randrange(len(created)))):
+                deleted += 1
+    return ops - deleted
+
+
+def run_threads(threads: int, ops: int):
+    store = FakeDB()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        alive = sum(pool.map(worker, [store] * threads, [ops] * threads, range(threads)))
+    elapsed = time.perf_counter() - start
+    check_store(store, alive)
+    total = threads * ops
+    print(f"threads      : {threads} x {ops} ops in {elapsed:.2f}s ({total / elapsed:,.0f} ops/s)")
+
+
+async def run_requests(ops: int, concurrency: int):
+    from db import db
+    from main import app
+
+    db.delete_all_tasks()
+    await db.reclaim()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def request(client: httpx.AsyncClient, i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post("/tasks/", json={"title": f"task {i}"})
+            task_id = response.json()["id"]
+            await client.put(f"/tasks/{task_id}", json={"completed": i % 2 == 0})
+            latencies.append(time.perf_counter() - start)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(request(client, i) for i in range(ops)))
+        elapsed = time.perf_counter() - start
+
+    check_store(db, ops)
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(
+        f"requests     : {ops} create+update at concurrency {concurrency} in {elapsed:.2f}s "
+        f"({2 * ops / elapsed:,.0f} req/s, p99 {p99 * 1000:.1f} ms)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=20_000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    args = parser.parse_args()
+
+    run_threads(args.threads, args.ops)
+    asyncio.run(run_requests(args.ops, args.concurrency))
+    print("ok: no duplicate ids, no lost writes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Throughput of the Task Manager API with 1, 2, 4 and 8 uvicorn workers
+sharing one Redis-backed store.
+
+Start a Redis server, then run from the `app` folder:
+
+    python -m benchmarks.workers --redis-url redis://localhost:6379/15 --seconds 10
+
+Each round starts `uvicorn main:app --workers N` with TASKS_REDIS_URL set,
+truncates the store, and keeps `--concurrency` requests in flight for
+`--seconds`: creates, page reads, task reads and updates. It then checks
+that every worker handed out distinct ids and that every created task is
+visible through the API.
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+
+
+async def wait_until_ready(client: httpx.AsyncClient, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+async def drive(client: httpx.AsyncClient, seconds: float, concurrency: int):
+    created = []
+    completed = 0
+    deadline = time.monotonic() + seconds
+
+    async def user(seed: int):
+        nonlocal completed
+        rng = random.Random(seed)
+        while time.monotonic() < deadline:
+            roll = rng.random()
+            if roll < 0.3 or not created:
+                response = await client.post("/tasks/", json={"title": f"task {seed}"})
+                created.append(response.json()["id"])
+            elif roll < 0.6:
+                await client.get("/tasks/", params={"skip": rng.randrange(max(len(created) - 10, 1)), "limit": 10})
+            elif roll < 0.85:
+                await client.get(f"/tasks/{rng.choice(created)}")
+            else:
+                await client.put(f"/tasks/{rng.choice(created)}", json={"completed": True})
+            completed += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user(seed) for seed in range(concurrency)))
+    return created, completed / (time.perf_counter() - start)
+
+
+async def run_round(workers: int, args) -> float:
+    env = {**os.environ, "TASKS_REDIS_URL": args.redis_url}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--workers", str(workers), "--log-level", "warning"],
+        env=env,
+    )
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=30) as client:
+            await wait_until_ready(client)
+            await client.delete("/tasks/", params={"confirm": "true"})
+            created, throughput = await drive(client, args.seconds, args.concurrency)
+
+            assert len(created) == len(set(created)), "workers handed out duplicate ids"
+            for task_id in random.sample(created, min(len(created), 200)):
+                response = await client.get(f"/tasks/{task_id}")
+                assert response.status_code == 200, f"task {task_id} is missing"
+        return throughput
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    baseline = None
+    for workers in args.workers:
+        throughput = asyncio.run(run_round(workers, args))
+        baseline = baseline or throughput
+        print(f"{workers} worker(s): {throughput:8,.0f} req/s  ({throughput / baseline:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
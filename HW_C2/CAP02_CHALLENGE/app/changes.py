@@ -0,0 +1,103 @@
+import asyncio
+import threading
+from collections import deque
+from typing import AsyncGenerator, List, Optional
+
+from models import Task, TaskChange
+
+HISTORY_SIZE = 1024
+SUBSCRIBER_QUEUE_SIZE = 256
+
+
+class Subscriber:
+    """
+    A listener of the change feed bound to the event loop it subscribed from.
+
+    Changes are queued in a bounded queue. When the queue is full the
+    subscriber is marked as overflowed and stops receiving changes, so a slow
+    client cannot make the feed hold more than `SUBSCRIBER_QUEUE_SIZE` changes.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, maxsize: int):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.overflowed = False
+
+    def deliver(self, change: TaskChange):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(change)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class ChangeFeed:
+    """
+    Sequenced feed of task changes with a bounded replay history.
+
+    The store publishes from its write paths; listeners resume from a sequence
+    number as long as it is still in the ring buffer of the last `history`
+    changes, otherwise they are told to reset.
+    """
+
+    def __init__(self, history: int = HISTORY_SIZE, subscriber_queue: int = SUBSCRIBER_QUEUE_SIZE):
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._history: deque = deque(maxlen=history)
+        self._subscribers = set()
+        self._subscriber_queue = subscriber_queue
+
+    @property
+    def seq(self) -> int:
+        return self._seq
+
+    def publish(self, change_type: str, task_id: Optional[int] = None, task: Optional[Task] = None) -> TaskChange:
+        """Records a change and hands it to every subscriber on its own event loop. Safe to call from any thread."""
+        with self._lock:
+            self._seq += 1
+            change = TaskChange.model_construct(seq=self._seq, type=change_type, task_id=task_id, task=task)
+            self._history.append(change)
+            for subscriber in self._subscribers:
+                subscriber.loop.call_soon_threadsafe(subscriber.deliver, change)
+        return change
+
+    def _subscribe(self, since: Optional[int]):
+        subscriber = Subscriber(asyncio.get_running_loop(), self._subscriber_queue)
+        with self._lock:
+            backlog: Optional[List[TaskChange]] = []
+            if since is not None and since != self._seq:
+                oldest = self._history[0].seq if self._history else self._seq + 1
+                if since + 1 < oldest or since > self._seq:
+                    backlog = None
+                else:
+                    backlog = [change for change in self._history if change.seq > since]
+            self._subscribers.add(subscriber)
+        return subscriber, backlog
+
+    def _unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    async def listen(self, since: Optional[int] = None) -> AsyncGenerator[Optional[TaskChange], None]:
+        """
+        Yields changes after `since`, or only new ones when `since` is None.
+
+        Stops when the listener overflows its queue; the client reconnects
+        from the last change it saw and catches up from the history. Yields
+        None once and stops when `since` is no longer in the history: the
+        client should then reload its tasks and listen from `seq`.
+        """
+        subscriber, backlog = self._subscribe(since)
+        try:
+            if backlog is None:
+                yield None
+                return
+            for change in backlog:
+                yield change
+            while True:
+                if subscriber.overflowed and subscriber.queue.empty():
+                    return
+                yield await subscriber.queue.get()
+        finally:
+            self._unsubscribe(subscriber)
@@ -1,36 +1,309 @@
-from models import Task
+import asyncio
+import os
+import secrets
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+from changes import ChangeFeed
+from models import Task, TaskStats
+from stats import TaskCounters
+
+RECLAIM_BATCH_SIZE = 10_000
+PAGE_CACHE_SIZE = 1024
+COMPACT_MIN_DEAD = 4096
+SCAN_CHUNK = 1 << 16
+
+
+class StringTable:
+    """Interned strings referenced by index. Index 0 is reserved for None."""
+
+    __slots__ = ("strings", "index")
+
+    def __init__(self):
+        self.strings: List[Optional[str]] = [None]
+        self.index: Dict[str, int] = {}
+
+    def intern(self, value: Optional[str]) -> int:
+        if value is None:
+            return 0
+        ref = self.index.get(value)
+        if ref is None:
+            ref = len(self.strings)
+            self.strings.append(value)
+            self.index[value] = ref
+        return ref
+
+
+class TaskColumns:
+    """
+    One generation of tasks stored column by column.
+
+    Row `r` is the task `ids[r]`. Ids are appended in increasing order, so a
+    task is found by binary search. Deleted rows are only flagged in `alive`
+    until the columns are compacted.
+    """
+
+    __slots__ = ("ids", "alive", "completed", "titles", "descriptions", "versions", "strings", "dead")
+
+    def __init__(self):
+        self.ids = array("q")
+        self.alive = bytearray()
+        self.completed = bytearray()
+        self.titles = array("I")
+        self.descriptions = array("I")
+        self.versions = array("q")
+        self.strings = StringTable()
+        self.dead = 0
+
+    def __len__(self):
+        return len(self.ids) - self.dead
+
+    def append(self, task_id: int, task: Task, version: int):
+        self.ids.append(task_id)
+        self.alive.append(1)
+        self.completed.append(task.completed)
+        self.titles.append(self.strings.intern(task.title))
+        self.descriptions.append(self.strings.intern(task.description))
+        self.versions.append(version)
+
+    def find(self, task_id: int) -> Optional[int]:
+        row = bisect_left(self.ids, task_id)
+        if row < len(self.ids) and self.ids[row] == task_id and self.alive[row]:
+            return row
+        return None
+
+    def nth_alive(self, n: int) -> int:
+        """Returns the row of the n-th live task, or the row count if there is none."""
+        if not self.dead:
+            return min(n, len(self.ids))
+        alive, pos, end = self.alive, 0, len(self.ids)
+        while pos < end:
+            count = alive.count(1, pos, pos + SCAN_CHUNK)
+            if count > n:
+                break
+            n -= count
+            pos += SCAN_CHUNK
+        while pos < end:
+            pos = alive.find(1, pos)
+            if pos == -1:
+                return end
+            if n == 0:
+                return pos
+            n -= 1
+            pos += 1
+        return end
+
+    def materialize(self, row: int) -> Task:
+        strings = self.strings.strings
+        return Task.model_construct(
+            id=self.ids[row],
+            title=strings[self.titles[row]],
+            description=strings[self.descriptions[row]],
+            completed=bool(self.completed[row]),
+        )
+
+    def needs_compaction(self) -> bool:
+        """
+        True once dead rows outnumber live ones, or once most strings are no
+        longer used by any row. A live row uses at most two strings, so the
+        rest are at least garbage: titles and descriptions replaced by updates.
+        """
+        live = len(self)
+        if self.dead >= COMPACT_MIN_DEAD and self.dead > live:
+            return True
+        garbage = len(self.strings.strings) - 1 - 2 * live
+        return garbage >= COMPACT_MIN_DEAD and garbage > 2 * live
+
+    def compacted(self) -> "TaskColumns":
+        """Copies the live rows into new columns, dropping strings no live row uses."""
+        columns = TaskColumns()
+        strings = self.strings.strings
+        for row, alive in enumerate(self.alive):
+            if alive:
+                columns.ids.append(self.ids[row])
+                columns.alive.append(1)
+                columns.completed.append(self.completed[row])
+                columns.titles.append(columns.strings.intern(strings[self.titles[row]]))
+                columns.descriptions.append(columns.strings.intern(strings[self.descriptions[row]]))
+                columns.versions.append(self.versions[row])
+        return columns
 
 
 class FakeDB:
+    """
+    In-memory task store that is safe to share between concurrent writers.
+
+    - Ids come from a monotonic counter, so they are never reused after deletes.
+    - Tasks are kept in compact `TaskColumns` and only materialized as `Task`
+      models when they are read. Every read and write takes `_lock`, and reads
+      return fresh models, so a reader always sees a consistent row.
+    - `version` grows on every write and each row keeps the version of its
+      last write. Together with `epoch`, which changes on every restart, they
+      back the router's ETags.
+    - Serialized pages cached by the router are dropped on every write.
+    - Every write is published to `changes` while the lock is held, so the
+      feed order matches the write order.
+    - Every write also updates the aggregates in `counters`.
+    - Calls never wait on I/O, so the router runs them on the event loop.
+    """
+
+    blocking = False
+
     def __init__(self):
-        self.tasks = []
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self.columns = TaskColumns()
+        self.epoch = secrets.token_hex(4)
+        self.version = 0
+        self.generation = 0
+        self._pages: Dict[Tuple[int, int], bytes] = {}
+        self.changes = ChangeFeed()
+        self.counters = TaskCounters()
+        self._retired: List[TaskColumns] = []
+
+    def __len__(self):
+        return len(self.columns)
 
     def add_task(self, task: Task):
-        task.id = len(self.tasks) + 1
-        self.tasks.append(task)
+        with self._lock:
+            task_id = self._next_id
+            self._next_id += 1
+            self._touch()
+            self.columns.append(task_id, task, self.version)
+            self.counters.created(task.completed)
+            task = self.columns.materialize(len(self.columns.ids) - 1)
+            self.changes.publish("create", task_id, task)
         return task
 
     def get_task(self, task_id: int):
-        task = next((task for task in self.tasks if task.id == task_id), None)
-        return task
+        with self._lock:
+            row = self.columns.find(task_id)
+            return None if row is None else self.columns.materialize(row)
+
+    def get_task_version(self, task_id: int) -> Optional[int]:
+        with self._lock:
+            row = self.columns.find(task_id)
+            return None if row is None else self.columns.versions[row]
 
-    def get_tasks(self):
-        return self.tasks
+    def get_tasks(self, skip: int = 0, limit: int = 10):
+        with self._lock:
+            columns = self.columns
+            tasks = []
+            row = columns.nth_alive(skip)
+            while row < len(columns.ids) and len(tasks) < limit:
+                if columns.alive[row]:
+                    tasks.append(columns.materialize(row))
+                row += 1
+            return tasks
 
     def update_task(self, task_id: int, task_update):
-        for task in self.tasks:
-            if task.id == task_id:
-                if task_update.title is not None:
-                    task.title = task_update.title
-                if task_update.description is not None:
-                    task.description = task_update.description
-                if task_update.completed is not None:
-                    task.completed = task_update.completed
-                return task
-        return None
+        with self._lock:
+            columns = self.columns
+            row = columns.find(task_id)
+            if row is None:
+                return None
+            if task_update.title is not None:
+                columns.titles[row] = columns.strings.intern(task_update.title)
+            if task_update.description is not None:
+                columns.descriptions[row] = columns.strings.intern(task_update.description)
+            if task_update.completed is not None:
+                self.counters.changed(bool(columns.completed[row]), task_update.completed)
+                columns.completed[row] = task_update.completed
+            self._touch()
+            columns.versions[row] = self.version
+            task = columns.materialize(row)
+            if columns.needs_compaction():
+                self.columns = columns.compacted()
+            self.changes.publish("update", task_id, task)
+        return task
 
     def delete_task(self, task_id: int):
-        self.tasks = [task for task in self.tasks if task.id != task_id]
+        """
+        Flags the task as deleted. Once dead rows outnumber live ones the
+        columns are compacted, which keeps deletes amortized O(1). Updates
+        compact the same way once replaced strings outnumber the used ones.
+        """
+        with self._lock:
+            columns = self.columns
+            row = columns.find(task_id)
+            if row is None:
+                return False
+            columns.alive[row] = 0
+            columns.dead += 1
+            self.counters.deleted(bool(columns.completed[row]))
+            if columns.needs_compaction():
+                self.columns = columns.compacted()
+            self._touch()
+            self.changes.publish("delete", task_id)
+            return True
+
+    def delete_all_tasks(self):
+        """
+        Truncates the store in O(1) by starting a new generation.
+
+        The current columns are swapped for empty ones, so new reads see an
+        empty store at once. The old columns are parked until `reclaim` frees
+        them. Ids keep counting across generations.
+        """
+        with self._lock:
+            self._retired.append(self.columns)
+            self.columns = TaskColumns()
+            self.counters.cleared()
+            self.generation += 1
+            self._touch()
+            self.changes.publish("clear")
+            return self.generation
+
+    def get_stats(self) -> TaskStats:
+        with self._lock:
+            return self.counters.snapshot(len(self.columns))
+
+    def cached_page(self, version: int, skip: int, limit: int) -> Optional[bytes]:
+        """Returns a serialized page cached at `version`, if there is one."""
+        if version != self.version:
+            return None
+        return self._pages.get((skip, limit))
+
+    def cache_page(self, version: int, skip: int, limit: int, body: bytes):
+        """Caches a serialized page unless a write happened after it was rendered."""
+        with self._lock:
+            if version != self.version:
+                return
+            if len(self._pages) >= PAGE_CACHE_SIZE:
+                self._pages.clear()
+            self._pages[(skip, limit)] = body
+
+    def _touch(self):
+        """Records a write. Must be called with `_lock` held."""
+        self.version += 1
+        self._pages.clear()
+
+    async def reclaim(self):
+        """
+        Frees retired generations in batches, yielding to the event loop
+        between them. The column arrays are single buffers and go at once; the
+        string table is what holds one object per task.
+        """
+        while self._retired:
+            strings = self._retired.pop().strings
+            while strings.index:
+                for _ in range(min(RECLAIM_BATCH_SIZE, len(strings.index))):
+                    strings.index.popitem()
+                await asyncio.sleep(0)
+            while strings.strings:
+                del strings.strings[-RECLAIM_BATCH_SIZE:]
+                await asyncio.sleep(0)
+
+
+# Set TASKS_REDIS_URL (e.g. redis://localhost:6379/0) to share the tasks
+# between several uvicorn workers.
+TASKS_REDIS_URL = os.environ.get("TASKS_REDIS_URL")
 
+if TASKS_REDIS_URL:
+    from redis_db import RedisDB
 
-db = FakeDB()
+    db = RedisDB(TASKS_REDIS_URL)
+else:
+    db = FakeDB()
@@ -1,3 +1,4 @@
+from datetime import datetime
 from pydantic import BaseModel
 from typing import Optional, List
 
@@ -17,3 +18,24 @@ class UpdateTaskModel(BaseModel):
 
 class TaskList(BaseModel):
     tasks: List[Task]
+
+
+class TaskChange(BaseModel):
+    seq: int
+    type: str
+    task_id: Optional[int] = None
+    task: Optional[Task] = None
+
+
+class StatsBucket(BaseModel):
+    start: datetime
+    created: int
+    completed: int
+
+
+class TaskStats(BaseModel):
+    total: int
+    completed: int
+    pending: int
+    bucket_seconds: int
+    buckets: List[StatsBucket]
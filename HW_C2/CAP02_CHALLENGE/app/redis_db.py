@@ -0,0 +1,295 @@
+import json
+import secrets
+import threading
+from typing import AsyncGenerator, Dict, Optional, Tuple
+
+import redis
+import redis.asyncio
+
+from changes import HISTORY_SIZE, SUBSCRIBER_QUEUE_SIZE
+from models import Task, TaskChange, TaskStats
+from stats import build_stats, current_bucket, recent_buckets
+
+PAGE_CACHE_SIZE = 1024
+LISTEN_BLOCK_MS = 15_000
+
+# Layout, all keys under "tasks:":
+#   generation, next_id, version, seq  counters
+#   epoch                              random tag set once, part of every ETag
+#   changes                            stream of the last HISTORY_SIZE changes, ids are "<seq>-0"
+#   retired                            set of generations waiting for `reclaim`
+#   <generation>:rows                  hash of id -> task JSON
+#   <generation>:versions              hash of id -> version of the task's last write
+#   <generation>:index                 sorted set of ids, for pagination
+#   <generation>:completed             number of completed tasks
+#   stats:created, stats:completed     hashes of bucket start -> created / completed events
+#
+# Every write runs as a single Lua script, so id allocation, the row, the
+# version counters and the change stream are always updated together.
+_PREAMBLE = """
+local g = redis.call('GET', 'tasks:generation') or '0'
+local rows = 'tasks:' .. g .. ':rows'
+local versions = 'tasks:' .. g .. ':versions'
+local index = 'tasks:' .. g .. ':index'
+local completed = 'tasks:' .. g .. ':completed'
+local function publish(change_type, task_id, row)
+    local seq = redis.call('INCR', 'tasks:seq')
+    redis.call('XADD', 'tasks:changes', 'MAXLEN', '~', ARGV[#ARGV], seq .. '-0',
+        'type', change_type, 'task_id', task_id, 'task', row)
+end
+"""
+
+_ADD_TASK = _PREAMBLE + """
+local id = redis.call('INCR', 'tasks:next_id')
+local version = redis.call('INCR', 'tasks:version')
+local task = cjson.decode(ARGV[1])
+task['id'] = id
+local row = cjson.encode(task)
+redis.call('HSET', rows, id, row)
+redis.call('HSET', versions, id, version)
+redis.call('ZADD', index, id, id)
+redis.call('HINCRBY', 'tasks:stats:created', ARGV[2], 1)
+if task['completed'] then
+    redis.call('INCR', completed)
+    redis.call('HINCRBY', 'tasks:stats:completed', ARGV[2], 1)
+end
+publish('create', id, row)
+return row
+"""
+
+_UPDATE_TASK = _PREAMBLE + """
+local row = redis.call('HGET', rows, ARGV[1])
+if not row then
+    return false
+end
+local task = cjson.decode(row)
+local was_completed = task['completed']
+for field, value in pairs(cjson.decode(ARGV[2])) do
+    task[field] = value
+end
+if task['completed'] and not was_completed then
+    redis.call('INCR', completed)
+    redis.call('HINCRBY', 'tasks:stats:completed', ARGV[3], 1)
+elseif was_completed and not task['completed'] then
+    redis.call('DECR', completed)
+end
+row = cjson.encode(task)
+redis.call('HSET', rows, ARGV[1], row)
+redis.call('HSET', versions, ARGV[1], redis.call('INCR', 'tasks:version'))
+publish('update', ARGV[1], row)
+return row
+"""
+
+_DELETE_TASK = _PREAMBLE + """
+local row = redis.call('HGET', rows, ARGV[1])
+if not row then
+    return 0
+end
+if cjson.decode(row)['completed'] then
+    redis.call('DECR', completed)
+end
+redis.call('HDEL', rows, ARGV[1])
+redis.call('HDEL', versions, ARGV[1])
+redis.call('ZREM', index, ARGV[1])
+redis.call('INCR', 'tasks:version')
+publish('delete', ARGV[1], '')
+return 1
+"""
+
+_DELETE_ALL_TASKS = _PREAMBLE + """
+redis.call('SADD', 'tasks:retired', g)
+redis.call('INCR', 'tasks:version')
+publish('clear', '', '')
+return redis.call('INCR', 'tasks:generation')
+"""
+
+_GET_TASK = _PREAMBLE + """
+return redis.call('HGET', rows, ARGV[1])
+"""
+
+_GET_TASK_VERSION = _PREAMBLE + """
+return redis.call('HGET', versions, ARGV[1])
+"""
+
+_GET_TASKS = _PREAMBLE + """
+local ids = redis.call('ZRANGE', index, ARGV[1], ARGV[2])
+if #ids == 0 then
+    return {}
+end
+return redis.call('HMGET', rows, unpack(ids))
+"""
+
+_GET_COUNTS = _PREAMBLE + """
+return {redis.call('ZCARD', index), tonumber(redis.call('GET', completed) or '0')}
+"""
+
+
+def _decode_change(seq: int, fields: dict) -> TaskChange:
+    task = fields[b"task"]
+    task_id = fields[b"task_id"]
+    return TaskChange(
+        seq=seq,
+        type=fields[b"type"].decode(),
+        task_id=int(task_id) if task_id else None,
+        task=Task.model_validate_json(task) if task else None,
+    )
+
+
+class RedisChangeFeed:
+    """
+    Change feed shared by every worker, backed by the `tasks:changes` stream.
+
+    Same `seq` and `listen` interface as `changes.ChangeFeed`. The store's
+    scripts append the changes; listeners read the stream at their own pace,
+    so a slow client only holds up its own connection.
+    """
+
+    def __init__(self, url: str):
+        self.client = redis.Redis.from_url(url)
+        self.async_client = redis.asyncio.Redis.from_url(url)
+
+    @property
+    def seq(self) -> int:
+        return int(self.client.get("tasks:seq") or 0)
+
+    async def listen(self, since: Optional[int] = None) -> AsyncGenerator[Optional[TaskChange], None]:
+        """Yields changes after `since`; yields None and stops when some of them were already trimmed."""
+        current = int(await self.async_client.get("tasks:seq") or 0)
+        last = current if since is None else since
+        if last > current:
+            yield None
+            return
+        while True:
+            entries = await self.async_client.xread(
+                {"tasks:changes": f"{last}-0"}, count=SUBSCRIBER_QUEUE_SIZE, block=LISTEN_BLOCK_MS
+            )
+            if not entries and last < current:
+                yield None
+                return
+            for _, items in entries:
+                for entry_id, fields in items:
+                    seq = int(entry_id.split(b"-")[0])
+                    if seq != last + 1:
+                        yield None
+                        return
+                    last = seq
+                    yield _decode_change(seq, fields)
+            current = last
+
+
+class RedisDB:
+    """
+    Task store shared by every worker process, kept in a Redis server.
+
+    It has the same interface as `db.FakeDB`, including O(1) truncation by
+    generation, and lets the API run with several uvicorn workers. Serialized
+    pages are cached per process and keyed by the global version, so a write
+    from any worker invalidates them. Every call waits on a round trip to the
+    server, so the router runs the calls in the threadpool.
+    """
+
+    blocking = True
+
+    def __init__(self, url: str):
+        self.client = redis.Redis.from_url(url)
+        self.client.set("tasks:epoch", secrets.token_hex(4), nx=True)
+        self.epoch = self.client.get("tasks:epoch").decode()
+        self.changes = RedisChangeFeed(url)
+        self._pages: Dict[Tuple[int, int], Tuple[int, bytes]] = {}
+        self._pages_lock = threading.Lock()
+        self._add_task = self.client.register_script(_ADD_TASK)
+        self._update_task = self.client.register_script(_UPDATE_TASK)
+        self._delete_task = self.client.register_script(_DELETE_TASK)
+        self._delete_all_tasks = self.client.register_script(_DELETE_ALL_TASKS)
+        self._get_task = self.client.register_script(_GET_TASK)
+        self._get_task_version = self.client.register_script(_GET_TASK_VERSION)
+        self._get_tasks = self.client.register_script(_GET_TASKS)
+        self._get_counts = self.client.register_script(_GET_COUNTS)
+
+    def __len__(self):
+        generation = int(self.client.get("tasks:generation") or 0)
+        return self.client.zcard(f"tasks:{generation}:index")
+
+    @property
+    def version(self) -> int:
+        return int(self.client.get("tasks:version") or 0)
+
+    @property
+    def generation(self) -> int:
+        return int(self.client.get("tasks:generation") or 0)
+
+    def _run(self, script, *args):
+        return script(args=[*args, HISTORY_SIZE])
+
+    def add_task(self, task: Task):
+        row = self._run(self._add_task, task.model_dump_json(exclude={"id"}), current_bucket())
+        self._pages.clear()
+        return Task.model_validate_json(row)
+
+    def get_task(self, task_id: int):
+        row = self._run(self._get_task, task_id)
+        return None if row is None else Task.model_validate_json(row)
+
+    def get_task_version(self, task_id: int) -> Optional[int]:
+        version = self._run(self._get_task_version, task_id)
+        return None if version is None else int(version)
+
+    def get_tasks(self, skip: int = 0, limit: int = 10):
+        rows = self._run(self._get_tasks, skip, skip + limit - 1)
+        return [Task.model_validate_json(row) for row in rows if row is not None]
+
+    def update_task(self, task_id: int, task_update):
+        changes = json.dumps(task_update.model_dump(exclude_none=True))
+        row = self._run(self._update_task, task_id, changes, current_bucket())
+        self._pages.clear()
+        return None if row is None else Task.model_validate_json(row)
+
+    def delete_task(self, task_id: int):
+        deleted = self._run(self._delete_task, task_id)
+        self._pages.clear()
+        return bool(deleted)
+
+    def delete_all_tasks(self):
+        generation = self._run(self._delete_all_tasks)
+        self._pages.clear()
+        return generation
+
+    def get_stats(self) -> TaskStats:
+        total, completed = self._run(self._get_counts)
+        starts = recent_buckets()
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.hmget("tasks:stats:created", starts)
+        pipeline.hmget("tasks:stats:completed", starts)
+        created, done = pipeline.execute()
+        return build_stats(
+            total,
+            completed,
+            starts,
+            (int(count or 0) for count in created),
+            (int(count or 0) for count in done),
+        )
+
+    def cached_page(self, version: int, skip: int, limit: int) -> Optional[bytes]:
+        cached = self._pages.get((skip, limit))
+        if cached is None or cached[0] != version:
+            return None
+        return cached[1]
+
+    def cache_page(self, version: int, skip: int, limit: int, body: bytes):
+        with self._pages_lock:
+            if len(self._pages) >= PAGE_CACHE_SIZE:
+                self._pages.clear()
+            self._pages[(skip, limit)] = (version, body)
+
+    async def reclaim(self):
+        """Drops retired generations with UNLINK, which frees their memory in a Redis background thread."""
+        client = self.changes.async_client
+        for generation in await client.smembers("tasks:retired"):
+            generation = generation.decode()
+            await client.unlink(
+                f"tasks:{generation}:rows",
+                f"tasks:{generation}:versions",
+                f"tasks:{generation}:index",
+                f"tasks:{generation}:completed",
+            )
+            await client.srem("tasks:retired", generation)
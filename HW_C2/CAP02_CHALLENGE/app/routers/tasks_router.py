@@ -1,10 +1,34 @@
-from fastapi import APIRouter, HTTPException, Query
-from models import Task, UpdateTaskModel, TaskList
+from typing import Optional
+from fastapi import APIRouter, BackgroundTasks, Header, HTTPException, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from sse_starlette.sse import EventSourceResponse
+from models import Task, UpdateTaskModel, TaskList, TaskStats
 from db import db
 
 tasks_router = APIRouter()
 
 
+def make_etag(*parts) -> str:
+    return '"' + "-".join(str(part) for part in parts) + '"'
+
+
+async def call(method, *args, **kwargs):
+    """Calls a store method, in the threadpool when the store blocks on I/O, so the event loop keeps serving."""
+    if db.blocking:
+        return await run_in_threadpool(method, *args, **kwargs)
+    return method(*args, **kwargs)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Checks an If-None-Match header against an ETag (weak comparison, as RFC 9110 requires)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    return etag in candidates
+
+
 @tasks_router.post("/", response_model=Task)
 async def create_task(task: Task):
     """
@@ -16,20 +40,72 @@ async def create_task(task: Task):
     Returns:
         Task: The created task.
     """
-    created_task = db.add_task(task)
+    created_task = await call(db.add_task, task)
     if created_task is None:
         raise HTTPException(status_code=500, detail="Failed to create task")
     return created_task
 
 
+@tasks_router.get("/stats", response_model=TaskStats)
+async def get_stats():
+    """
+    Retrieve task aggregates.
+
+    The counts are maintained by the store on every write, so this is O(1)
+    whatever the number of tasks. Each bucket counts the tasks created and the
+    tasks marked as completed during it.
+
+    Returns:
+        TaskStats: Total, completed and pending counts plus per-bucket activity.
+    """
+    return await call(db.get_stats)
+
+
+async def change_events(since: Optional[int]):
+    async for change in db.changes.listen(since):
+        if change is None:
+            yield {"event": "reset", "data": str(await call(lambda: db.changes.seq))}
+            return
+        yield {"id": str(change.seq), "event": change.type, "data": change.model_dump_json()}
+
+
+@tasks_router.get("/changes", summary="Stream task changes")
+async def stream_changes(
+    since: Optional[int] = Query(None, ge=0),
+    last_event_id: Optional[str] = Header(None),
+):
+    """
+    Stream task changes as Server-Sent Events.
+
+    Each event is named after the change (create, update, delete or clear) and
+    its id is the change sequence number. Reconnecting clients resume after the
+    Last-Event-ID header, or after `since`. When that point is no longer in the
+    feed history a single `reset` event carrying the current sequence number is
+    sent: reload the tasks and listen again from that number.
+
+    Args:
+        since (int, optional): Sequence number of the last change already seen.
+        last_event_id (str, optional): Set by EventSource clients on reconnect.
+
+    Returns:
+        EventSourceResponse: The change stream.
+    """
+    if last_event_id is not None and last_event_id.isdigit():
+        since = int(last_event_id)
+    return EventSourceResponse(change_events(since))
+
 
 @tasks_router.get("/{task_id}", response_model=Task)
-async def get_task(task_id: int):
+async def get_task(task_id: int, if_none_match: Optional[str] = Header(None)):
     """
     Retrieve a task by its ID.
 
+    The response carries an ETag built from the task's version. A request whose
+    If-None-Match matches it gets a 304 without the task being read.
+
     Args:
         task_id (int): The ID of the task to retrieve.
+        if_none_match (str, optional): ETag of the client's cached copy.
 
     Returns:
         Task: The requested task.
@@ -37,31 +113,54 @@ async def get_task(task_id: int):
     Raises:
         HTTPException: If the task is not found.
     """
-    task = db.get_task(task_id)
+    version = await call(db.get_task_version, task_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    etag = make_etag(db.epoch, task_id, version)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    task = await call(db.get_task, task_id)
     if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
-    return task
+    return Response(content=task.model_dump_json(), media_type="application/json", headers={"ETag": etag})
 
 
 @tasks_router.get("/", response_model=TaskList)
-async def get_tasks(skip: int = Query(0, ge=0), limit: int = Query(10, ge=1, le=100)):
+async def get_tasks(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(10, ge=1, le=100),
+    if_none_match: Optional[str] = Header(None),
+):
     """
     Retrieve a paginated list of tasks.
 
+    The response carries an ETag built from the store version and the page
+    bounds, and answers a matching If-None-Match with 304. Serialized pages are
+    cached in the store until the next write.
+
     Args:
         skip (int): Number of tasks to skip.
         limit (int): Maximum number of tasks to return.
+        if_none_match (str, optional): ETag of the client's cached copy.
 
     Returns:
         TaskList: A paginated list of tasks.
     """
-    tasks = db.get_tasks(skip=skip, limit=limit)
-    return TaskList(tasks=tasks)
+    version = await call(lambda: db.version)
+    etag = make_etag(db.epoch, version, skip, limit)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    body = db.cached_page(version, skip, limit)
+    if body is None:
+        tasks = await call(db.get_tasks, skip=skip, limit=limit)
+        body = TaskList(tasks=tasks).model_dump_json().encode()
+        db.cache_page(version, skip, limit, body)
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
 
 
 @tasks_router.put("/{task_id}", response_model=Task)
 async def update_task(task_id: int, task_update: UpdateTaskModel):
-    updated_task = db.update_task(task_id, task_update)
+    updated_task = await call(db.update_task, task_id, task_update)
     if updated_task is None:
         raise HTTPException(status_code=404, detail="Task not found")
     return updated_task
@@ -81,23 +180,25 @@ async def delete_task(task_id: int):
     Raises:
         HTTPException: If the task is not found.
     """
-    task = db.get_task(task_id)
-    if task is None:
+    if not await call(db.delete_task, task_id):
         raise HTTPException(status_code=404, detail="Task not found")
-    db.delete_task(task_id)
     return {"message": "Task deleted successfully"}
 
 
 
 
 @tasks_router.delete("/", summary="Delete all tasks")
-async def delete_all_tasks(confirm: bool = False):
+async def delete_all_tasks(background_tasks: BackgroundTasks, confirm: bool = False):
     """
-    WARNING: This operation deletes all tasks and can be expensive for large datasets.
-    Use with caution. Consider implementing authentication, batching, or pagination for safety.
+    Delete all tasks.
+
+    The store starts a new generation, so the tasks disappear immediately and
+    the memory they used is reclaimed in a background task after the response.
+    Consider implementing authentication for safety.
     """
     if not confirm:
         raise HTTPException(status_code=400, detail="Confirmation required to delete all tasks. Pass confirm=true.")
-    db.delete_all_tasks()
+    await call(db.delete_all_tasks)
+    background_tasks.add_task(db.reclaim)
     return {"message": "All tasks deleted successfully"}
 
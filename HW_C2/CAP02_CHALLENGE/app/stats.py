@@ -0,0 +1,90 @@
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List
+
+from models import StatsBucket, TaskStats
+
+BUCKET_SECONDS = 3600
+BUCKET_COUNT = 24
+
+
+def current_bucket() -> int:
+    """Start of the time bucket the current instant falls in, as a unix timestamp."""
+    now = int(time.time())
+    return now - now % BUCKET_SECONDS
+
+
+def recent_buckets() -> List[int]:
+    """Starts of the last BUCKET_COUNT buckets, oldest first."""
+    last = current_bucket()
+    return [last - BUCKET_SECONDS * i for i in range(BUCKET_COUNT - 1, -1, -1)]
+
+
+def build_stats(total: int, completed: int, starts: Iterable[int], created: Iterable[int], done: Iterable[int]) -> TaskStats:
+    buckets = [
+        StatsBucket(start=datetime.fromtimestamp(start, timezone.utc), created=created_count, completed=done_count)
+        for start, created_count, done_count in zip(starts, created, done)
+    ]
+    return TaskStats(
+        total=total,
+        completed=completed,
+        pending=total - completed,
+        bucket_seconds=BUCKET_SECONDS,
+        buckets=buckets,
+    )
+
+
+class TaskCounters:
+    """
+    Task aggregates kept up to date by the store's write paths.
+
+    `completed` is the number of stored tasks that are completed. Buckets count
+    events: tasks created, and tasks marked as completed, during each time
+    bucket. Only the last BUCKET_COUNT buckets are kept, so reads are O(1).
+    """
+
+    def __init__(self):
+        self.completed = 0
+        self.buckets: Dict[int, List[int]] = {}
+
+    def _bucket(self) -> List[int]:
+        start = current_bucket()
+        bucket = self.buckets.get(start)
+        if bucket is None:
+            cutoff = start - BUCKET_SECONDS * BUCKET_COUNT
+            for old in [old for old in self.buckets if old <= cutoff]:
+                del self.buckets[old]
+            bucket = self.buckets[start] = [0, 0]
+        return bucket
+
+    def created(self, completed: bool):
+        bucket = self._bucket()
+        bucket[0] += 1
+        if completed:
+            self.completed += 1
+            bucket[1] += 1
+
+    def changed(self, was_completed: bool, completed: bool):
+        if completed and not was_completed:
+            self.completed += 1
+            self._bucket()[1] += 1
+        elif was_completed and not completed:
+            self.completed -= 1
+
+    def deleted(self, was_completed: bool):
+        if was_completed:
+            self.completed -= 1
+
+    def cleared(self):
+        self.completed = 0
+
+    def snapshot(self, total: int) -> TaskStats:
+        starts = recent_buckets()
+        counts = [self.buckets.get(start, (0, 0)) for start in starts]
+        return build_stats(
+            total,
+            self.completed,
+            starts,
+            (count[0] for count in counts),
+            (count[1] for count in counts),
+        )
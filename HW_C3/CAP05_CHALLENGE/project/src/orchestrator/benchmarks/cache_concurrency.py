@@ -0,0 +1,97 @@
+"""
+Concurrent cache lookups with the old blocking Redis client and the async one.
+
+Each simulated /streamingSearch request runs the KNN lookup that starts
+`Retriever.get_context`. A ticker task measures how long the event loop
+stalls, which is what every other open SSE stream experiences.
+
+Needs a Redis Stack server. Run from the `orchestrator` folder:
+
+    python -m benchmarks.cache_concurrency --host localhost --requests 2000 --concurrency 64
+"""
+import argparse
+import asyncio
+import time
+
+import numpy as np
+import redis as sync_redis
+
+from models.document import Document
+from retrieval.cache import INDEX_NAME, RedisVectorCache
+
+
+class BlockingLookup:
+    """The lookup as it was before: a synchronous client called from a coroutine."""
+
+    def __init__(self, host, port) -> None:
+        self.client = sync_redis.Redis(host=host, port=port)
+
+    async def find_similar(self, vector, k=10):
+        return self.client.ft(INDEX_NAME).search(
+            RedisVectorCache.knn_query(k, "text", "url"),
+            {"query_vector": np.array(vector, dtype=np.float32).tobytes()},
+        )
+
+
+async def seed(cache: RedisVectorCache, dimension: int, count: int):
+    try:
+        await cache.init_index(vector_dimension=dimension)
+    except Exception:
+        pass
+    rng = np.random.default_rng(0)
+    documents = [
+        Document(text=f"benchmark chunk {i}", url="https://example.com", vector=rng.normal(size=dimension).tolist(), similarity=0)
+        for i in range(count)
+    ]
+    await cache.write(documents)
+
+
+async def run(lookup, args) -> str:
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(args.requests, args.dimension)).tolist()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    stalls = []
+    done = False
+
+    async def ticker():
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            stalls.append(time.perf_counter() - start - 0.001)
+
+    async def request(vector):
+        async with semaphore:
+            await lookup.find_similar(vector, k=10)
+
+    monitor = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    await asyncio.gather(*(request(vector) for vector in vectors))
+    elapsed = time.perf_counter() - start
+    done = True
+    await monitor
+
+    stalls.sort()
+    p99 = stalls[int(len(stalls) * 0.99) - 1] if stalls else 0
+    return (
+        f"{args.requests / elapsed:8,.0f} lookups/s   "
+        f"loop stall p99 {p99 * 1000:6.1f} ms, max {stalls[-1] * 1000 if stalls else 0:6.1f} ms"
+    )
+
+
+async def main(args):
+    cache = RedisVectorCache(host=args.host, port=args.port)
+    if args.seed:
+        await seed(cache, args.dimension, args.seed)
+    print(f"blocking client : {await run(BlockingLookup(args.host, args.port), args)}")
+    print(f"async client    : {await run(cache, args)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--seed", type=int, default=1000, help="random chunks to write first (0 to skip)")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    asyncio.run(main(parser.parse_args()))
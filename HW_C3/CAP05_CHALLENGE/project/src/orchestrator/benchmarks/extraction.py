@@ -0,0 +1,106 @@
+"""
+Throughput of HTML-to-text extraction, and how long it stalls the event loop.
+
+Compares the previous extraction (BeautifulSoup `html.parser` on the event
+loop), lxml on the event loop, and `Scraper.parse`, which runs lxml in the
+worker process pool. Pages are read from a saved corpus: a folder of
+`.html` files. To build one from a list of URLs, one per line:
+
+    python -m benchmarks.extraction --save corpus/ --urls urls.txt
+
+Then, from the `orchestrator` folder:
+
+    python -m benchmarks.extraction --corpus corpus/ --rounds 5
+"""
+import argparse
+import asyncio
+import hashlib
+import pathlib
+import re
+import time
+
+import aiohttp
+from bs4 import BeautifulSoup
+
+from retrieval.scraper import ScraperLocal, close_parse_pool, extract_text, start_parse_pool
+
+
+def extract_with_bs4(body: str) -> str:
+    soup = BeautifulSoup(body, "html.parser")
+    raw_text = soup.get_text(separator=" ", strip=True)
+    return re.sub(r"\n{3,}|\s{2,}", "\n", raw_text)
+
+
+async def save_corpus(folder: pathlib.Path, urls: list[str]):
+    folder.mkdir(parents=True, exist_ok=True)
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+
+        async def save(url):
+            try:
+                async with session.get(url) as response:
+                    if response.content_type == "text/html":
+                        name = hashlib.sha256(url.encode()).hexdigest()[:16]
+                        (folder / f"{name}.html").write_text(await response.text())
+            except (aiohttp.ClientError, asyncio.TimeoutError, UnicodeDecodeError) as e:
+                print(f"skipped {url}: {e!r}")
+
+        await asyncio.gather(*(save(url) for url in urls))
+
+
+async def run(extract, pages: list[str], rounds: int):
+    """Extracts every page `rounds` times, 10 at a time like one query does, with a ticker watching the loop."""
+    stalls = []
+    done = False
+
+    async def ticker():
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            stalls.append(time.perf_counter() - start - 0.001)
+
+    monitor = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for i in range(0, len(pages), 10):
+            await asyncio.gather(*(extract(page) for page in pages[i : i + 10]))
+    elapsed = time.perf_counter() - start
+    done = True
+    await monitor
+    return len(pages) * rounds / elapsed, max(stalls, default=0)
+
+
+async def main(args):
+    if args.save:
+        await save_corpus(pathlib.Path(args.save), pathlib.Path(args.urls).read_text().split())
+        return
+
+    pages = [path.read_text() for path in sorted(pathlib.Path(args.corpus).glob("*.html"))]
+    megabytes = sum(len(page) for page in pages) / 1e6
+    print(f"{len(pages)} pages, {megabytes:.1f} MB")
+
+    async def bs4_inline(page):
+        return extract_with_bs4(page)
+
+    async def lxml_inline(page):
+        return extract_text(page)
+
+    scraper = ScraperLocal()
+    await start_parse_pool()
+    print(f"{'extractor':<24}{'pages/s':>10}{'max loop stall ms':>20}")
+    for name, extract in [
+        ("bs4 on the loop", bs4_inline),
+        ("lxml on the loop", lxml_inline),
+        ("lxml on process pool", scraper.parse),
+    ]:
+        throughput, stall = await run(extract, pages, args.rounds)
+        print(f"{name:<24}{throughput:>10,.1f}{stall * 1000:>20.1f}")
+    close_parse_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default="corpus")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--save", help="folder to save the pages listed in --urls into, instead of benchmarking")
+    parser.add_argument("--urls")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,102 @@
+"""
+Recall and latency of HNSW vector indexes against the exact FLAT baseline.
+
+Random unit vectors are written under a separate `bench:` prefix with one
+FLAT index and one HNSW index over them. Every query is answered exactly
+with numpy and then through both indexes; HNSW is queried at several
+EF_RUNTIME values. Needs a Redis Stack server. Run from the `orchestrator`
+folder:
+
+    python -m benchmarks.index_recall --host localhost --chunks 50000 --queries 200
+"""
+import argparse
+import asyncio
+import time
+
+import numpy as np
+import redis.asyncio as redis
+
+from retrieval.cache import IndexConfig, RedisVectorCache
+
+PREFIX = "bench:"
+
+
+async def seed(cache: RedisVectorCache, vectors: np.ndarray, batch: int = 1000):
+    for start in range(0, len(vectors), batch):
+        pipeline = cache.client.pipeline(transaction=False)
+        for i in range(start, min(start + batch, len(vectors))):
+            pipeline.hset(f"{PREFIX}{i}", mapping={"text": str(i), "url": "", "vector": vectors[i].tobytes()})
+        await pipeline.execute()
+
+
+async def measure(cache: RedisVectorCache, name: str, queries: np.ndarray, truth: np.ndarray, k: int, ef_runtime=None):
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        result = await cache.client.ft(name).search(
+            RedisVectorCache.knn_query(k, "text", ef_runtime=ef_runtime),
+            {"query_vector": query.astype(np.float32).tobytes()},
+        )
+        latencies.append(time.perf_counter() - start)
+        found = {int(doc.text) for doc in result.docs}  # type: ignore
+        hits += len(found & set(expected.tolist()))
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+    return hits / truth.size, p50, p99
+
+
+async def main(args):
+    cache = RedisVectorCache(host=args.host, port=args.port)
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(args.chunks, args.dimension)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = rng.normal(size=(args.queries, args.dimension)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    truth = np.argsort(-(queries @ vectors.T), axis=1)[:, : args.k]
+
+    configs = {
+        "idx:bench:flat": IndexConfig(),
+        "idx:bench:hnsw": IndexConfig(algorithm="HNSW", m=args.m, ef_construction=args.ef_construction),
+    }
+    for name in configs:
+        try:
+            await cache.client.ft(name).dropindex(delete_documents=True)
+        except redis.ResponseError:
+            pass
+
+    start = time.perf_counter()
+    await seed(cache, vectors)
+    print(f"seeded {args.chunks:,} chunks in {time.perf_counter() - start:.1f}s")
+    for name, config in configs.items():
+        start = time.perf_counter()
+        await cache.create_index(name, args.dimension, config, prefix=PREFIX)
+        await cache.wait_for_indexing(name, poll_interval=0.1)
+        print(f"built {name} in {time.perf_counter() - start:.1f}s")
+
+    print(f"{'index':<28}{'recall@' + str(args.k):>10}{'p50 ms':>10}{'p99 ms':>10}")
+    recall, p50, p99 = await measure(cache, "idx:bench:flat", queries, truth, args.k)
+    print(f"{'FLAT':<28}{recall:>10.3f}{p50:>10.2f}{p99:>10.2f}")
+    for ef in args.ef_runtime:
+        recall, p50, p99 = await measure(cache, "idx:bench:hnsw", queries, truth, args.k, ef_runtime=ef)
+        print(f"{f'HNSW M={args.m} EF_RUNTIME={ef}':<28}{recall:>10.3f}{p50:>10.2f}{p99:>10.2f}")
+
+    if not args.keep:
+        # Both indexes cover the same keys: delete the chunks only once.
+        for name in configs:
+            await cache.client.ft(name).dropindex(delete_documents=name.endswith("hnsw"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--chunks", type=int, default=20_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--m", type=int, default=16)
+    parser.add_argument("--ef-construction", type=int, default=200)
+    parser.add_argument("--ef-runtime", type=int, nargs="+", default=[10, 50, 100, 200])
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark indexes and chunks")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,70 @@
+"""
+Throughput of the in-process CPU embeddings backend.
+
+Embeds synthetic chunks the size the splitter produces (400 characters)
+with `LocalEmbeddings`, for every combination of batch size and torch
+thread count, and reports chunks/s and the latency of a single-chunk call,
+which is what a query embedding costs. The model is loaded once per thread
+count, before timing. Needs `sentence-transformers`. Run from the
+`orchestrator` folder:
+
+    python -m benchmarks.local_embeddings --chunks 2000 --batch-sizes 16 64 --threads 1 4
+"""
+import argparse
+import asyncio
+import os
+import random
+import string
+import time
+
+from retrieval.embeddings import LocalEmbeddings
+
+
+def make_chunks(count: int, size: int) -> list[str]:
+    rng = random.Random(0)
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(5000)]
+    chunks = []
+    for _ in range(count):
+        chunk = ""
+        while len(chunk) < size:
+            chunk += rng.choice(words) + " "
+        chunks.append(chunk[:size])
+    return chunks
+
+
+async def measure(embeddings: LocalEmbeddings, chunks: list[str], queries: int):
+    await embeddings.run(chunks[:1])
+
+    start = time.perf_counter()
+    vectors = await embeddings.run(chunks)
+    throughput = len(chunks) / (time.perf_counter() - start)
+    assert len(vectors[0]) == embeddings.vector_dimension
+
+    latencies = []
+    for chunk in chunks[:queries]:
+        start = time.perf_counter()
+        await embeddings.run([chunk])
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return throughput, latencies[len(latencies) // 2] * 1000
+
+
+async def main(args):
+    chunks = make_chunks(args.chunks, args.chunk_size)
+    print(f"{'threads':>8}{'batch':>8}{'chunks/s':>12}{'1-chunk p50 ms':>16}")
+    for threads in args.threads:
+        embeddings = LocalEmbeddings(threads=threads)
+        for batch_size in args.batch_sizes:
+            embeddings.batch_size = batch_size
+            throughput, p50 = await measure(embeddings, chunks, args.queries)
+            print(f"{threads:>8}{batch_size:>8}{throughput:>12,.0f}{p50:>16.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--chunk-size", type=int, default=400)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 32, 64, 128])
+    parser.add_argument("--threads", type=int, nargs="+", default=sorted({1, os.cpu_count() or 1}))
+    parser.add_argument("--queries", type=int, default=50, help="single-chunk calls timed for latency")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,64 @@
+"""
+Top-k ranking of scraped chunks: the pandas + sklearn row-by-row version
+that `Retriever.get_most_similar` used before, against `ranking.top_k`.
+
+Both rank the same random chunks, given as lists of floats the way the
+embeddings backends return them, and the benchmark checks that they pick
+the same chunks. Run from the `orchestrator` folder:
+
+    python -m benchmarks.ranking --chunks 100 1000 10000 --dimension 1536
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics.pairwise import cosine_similarity
+
+from retrieval.ranking import top_k
+
+
+def rank_with_pandas(query_vector, data, k):
+    query_vector = np.array(query_vector).reshape(1, -1)
+    df = pd.DataFrame(data)
+    df["vector"] = df["vector"].apply(lambda x: np.array(x).reshape(1, -1))
+    df["similarity"] = df["vector"].apply(lambda row: cosine_similarity(query_vector, row)[0][0])
+    return df.nlargest(k, "similarity").index.tolist()
+
+
+def rank_with_numpy(query_vector, data, k):
+    indices, _ = top_k(query_vector, [doc["vector"] for doc in data], k)
+    return indices.tolist()
+
+
+def timed(function, repeat, *args):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, nargs="+", default=[100, 1000, 10_000])
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5, help="best of this many runs is reported")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    query_vector = rng.normal(size=args.dimension).tolist()
+    print(f"{'chunks':>8}{'pandas ms':>12}{'numpy ms':>12}{'speedup':>10}")
+    for count in args.chunks:
+        vectors = rng.normal(size=(count, args.dimension))
+        data = [{"text": str(i), "url": "", "vector": vector.tolist()} for i, vector in enumerate(vectors)]
+        old, expected = timed(rank_with_pandas, args.repeat, query_vector, data, args.k)
+        new, found = timed(rank_with_numpy, args.repeat, query_vector, data, args.k)
+        assert found == expected, "rankings differ"
+        print(f"{count:>8,}{old * 1000:>12.2f}{new * 1000:>12.2f}{old / new:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from typing import AsyncGenerator
 from fastapi import FastAPI
 from sse_starlette.sse import EventSourceResponse
@@ -7,16 +8,66 @@ import prompt
 import openai
 from retrieval import Retriever
 from retrieval.search import GoogleAPI
-from retrieval.cache import RedisVectorCache
-from retrieval.scraper import ScraperLocal, ScraperRemote
-from retrieval.embeddings import OpenAIEmbeddings, RemoteEmbeddings
+from retrieval.cache import IndexConfig, RedisVectorCache
+from retrieval.http_client import close_session
+from retrieval.page_cache import PageCache
+from retrieval.scraper import (
+    ScraperLocal,
+    ScraperRemote,
+    close_parse_pool,
+    start_parse_pool,
+)
+from retrieval.embeddings import (
+    CachedEmbeddings,
+    CoalescingEmbeddings,
+    EmbeddingDispatcher,
+    LocalEmbeddings,
+    OpenAIEmbeddings,
+    RemoteEmbeddings,
+)
 from retrieval.splitter import LangChainSplitter
 
 
 # # setup loggers
 # logging.config.fileConfig("logging.conf", disable_existing_loggers=False)  # type: ignore
 # logger = logging.getLogger(__name__)
-app = FastAPI()
+
+
+# Components are shared by every request: the in-process embedding cache
+# stays warm, the batch concurrency limit holds across requests, and query
+# embeddings from concurrent requests are coalesced into shared batches.
+# Queries go to the cache directly, so they never queue behind the chunk
+# batches of other requests before the vector cache lookup.
+redis = RedisVectorCache(host="cache", port=6379)
+cached_embeddings = CachedEmbeddings(OpenAIEmbeddings(), client=redis.client)
+# cached_embeddings = CachedEmbeddings(RemoteEmbeddings(), client=redis.client)
+# cached_embeddings = CachedEmbeddings(LocalEmbeddings(), client=redis.client)
+embeddings = EmbeddingDispatcher(cached_embeddings)
+retriever = Retriever(
+    cache=redis,
+    searcher=GoogleAPI(),
+    scraper=ScraperLocal(cache=PageCache()),
+    # scraper=ScraperRemote(),
+    embeddings=embeddings,
+    splitter=LangChainSplitter(chunk_size=400, chunk_overlap=50, length_function=len),
+    query_embeddings=CoalescingEmbeddings(cached_embeddings),
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_parse_pool()
+    index = await redis.migrate_index(
+        vector_dimension=embeddings.vector_dimension,
+        config=IndexConfig.from_env(),
+    )
+    logger.info(f"Serving vector cache from index {index}")
+    yield
+    await close_session()
+    close_parse_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 def stream_chat(prompt: str):
@@ -32,31 +83,8 @@ def stream_chat(prompt: str):
 
 
 async def event_generator(query) -> AsyncGenerator[dict, None]:
-    redis = RedisVectorCache(host="cache", port=6379)
-    embeddings = OpenAIEmbeddings()
-    google = GoogleAPI()
-    scraper = ScraperLocal()
-    splitter = LangChainSplitter(chunk_size=400, chunk_overlap=50, length_function=len)
-
-    # scraper = ScraperRemoteClient()
-    # embeddings = RemoteEmbeddings()
-
-    # redis.init_test()
-    try:
-        redis.init_index(vector_dimension=embeddings.vector_dimension)
-        logger.info(
-            f"Created index with vector dimensions {embeddings.vector_dimension}"
-        )
-    except:
-        logger.info("Index already exists.")
-
-    retriever = Retriever(
-        cache=redis,
-        searcher=google,
-        scraper=scraper,
-        embeddings=embeddings,
-        splitter=splitter,
-    )
+    # await redis.init_test()
+
     async for event in retriever.get_context(query=query, cache_treshold=0.85, k=10):
         yield event
         if event["event"] == "context":
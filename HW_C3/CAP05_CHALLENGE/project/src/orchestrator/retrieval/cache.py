@@ -1,18 +1,31 @@
 from abc import ABC, abstractmethod
+import asyncio
 import hashlib
-import json
+import os
+from typing import Literal, Optional
 import numpy as np
 import pandas as pd
-import redis
+import redis.asyncio as redis
 from redis.commands.search.field import (
     TextField,
     VectorField,
 )
 from redis.commands.search.indexDefinition import IndexDefinition, IndexType
 from redis.commands.search.query import Query
+from redis.commands.search.result import Result
+from pydantic import BaseModel
 from models.document import Document
+from retrieval.ranking import normalize
 
 VECTOR_DIMENSION = 1536
+INDEX_NAME = "idx:chunks_vss"
+DUPLICATE_THRESHOLD = 0.97
+
+# Every command holds a pooled connection while it runs, so MAX_CONNECTIONS
+# also bounds the commands in flight; extra callers wait up to POOL_TIMEOUT.
+MAX_CONNECTIONS = 32
+POOL_TIMEOUT = 5
+SOCKET_TIMEOUT = 2
 
 
 class VectorDbCache(ABC):
@@ -25,51 +38,191 @@ class VectorDbCache(ABC):
         pass
 
 
-SHA256 = hashlib.sha256()
+def chunk_key(text: str) -> str:
+    """Content-addressed key, so writing the same chunk twice refreshes it instead of duplicating it."""
+    return f"chunks:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+
+def pack_vector(vector: list[float]) -> bytes:
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def unpack_vector(blob: Optional[bytes]) -> Optional[list[float]]:
+    return None if blob is None else np.frombuffer(blob, dtype=np.float32).tolist()
+
+
+class IndexConfig(BaseModel):
+    """Vector index settings. FLAT is an exact brute-force scan; HNSW is an
+    approximate graph index whose query cost grows logarithmically."""
+
+    algorithm: Literal["FLAT", "HNSW"] = "FLAT"
+    m: int = 16
+    ef_construction: int = 200
+    ef_runtime: int = 10
+
+    @classmethod
+    def from_env(cls) -> "IndexConfig":
+        """Reads VECTOR_INDEX_ALGORITHM, VECTOR_INDEX_M, VECTOR_INDEX_EF_CONSTRUCTION and VECTOR_INDEX_EF_RUNTIME."""
+        settings = {
+            field: os.environ[f"VECTOR_INDEX_{field.upper()}"]
+            for field in cls.model_fields
+            if f"VECTOR_INDEX_{field.upper()}" in os.environ
+        }
+        return cls(**settings)
+
+    @property
+    def index_name(self) -> str:
+        """Name of the physical index; queries go through the INDEX_NAME alias.
+
+        Chunks are stored as hashes, so the names carry a `hash` segment that
+        keeps them apart from the earlier indexes over JSON documents.
+        """
+        if self.algorithm == "FLAT":
+            return f"{INDEX_NAME}:hash:flat"
+        return f"{INDEX_NAME}:hash:hnsw:m{self.m}:ef{self.ef_construction}"
+
+    def vector_attributes(self, vector_dimension: int) -> dict:
+        attributes = {
+            "TYPE": "FLOAT32",
+            "DIM": vector_dimension,
+            "DISTANCE_METRIC": "COSINE",
+        }
+        if self.algorithm == "HNSW":
+            attributes.update(
+                M=self.m,
+                EF_CONSTRUCTION=self.ef_construction,
+                EF_RUNTIME=self.ef_runtime,
+            )
+        return attributes
 
 
 class RedisVectorCache(VectorDbCache):
     _pool = None
+    # Settings of the index behind the alias, once `init_index` or
+    # `migrate_index` has run.
+    index_config: Optional[IndexConfig] = None
 
     def __init__(self, host, port) -> None:
         if RedisVectorCache._pool is None:
-            RedisVectorCache._pool = redis.ConnectionPool(host=host, port=port)
+            RedisVectorCache._pool = redis.BlockingConnectionPool(
+                host=host,
+                port=port,
+                max_connections=MAX_CONNECTIONS,
+                timeout=POOL_TIMEOUT,
+                socket_timeout=SOCKET_TIMEOUT,
+                socket_connect_timeout=SOCKET_TIMEOUT,
+            )
 
         self.client = redis.Redis(
             connection_pool=RedisVectorCache._pool, decode_responses=True
         )
 
-    async def find_similar(self, vector: list[float], k=10) -> list[Document]:
-        chunks = (
-            self.client.ft("idx:chunks_vss")
-            .search(
-                Query(f"(*)=>[KNN {k} @vector $query_vector AS vector_score]")
-                .sort_by("vector_score")
-                .return_fields("vector_score", "text", "url", "vector")
-                .dialect(2),
-                {"query_vector": np.array(vector, dtype=np.float32).tobytes()},
-            )
-            .docs  # type: ignore
+    @staticmethod
+    def knn_query(k: int, *fields: str, ef_runtime: Optional[int] = None) -> Query:
+        """KNN query on the vector field. `ef_runtime` overrides the HNSW search breadth."""
+        ef = f" EF_RUNTIME {ef_runtime}" if ef_runtime else ""
+        return (
+            Query(f"(*)=>[KNN {k} @vector $query_vector{ef} AS vector_score]")
+            .sort_by("vector_score")
+            .return_fields("vector_score", *fields)
+            .dialect(2)
         )
+
+    @property
+    def default_ef_runtime(self) -> Optional[int]:
+        """EF_RUNTIME sent with KNN queries: the configured one on HNSW indexes, none on FLAT.
+
+        It is passed on every query rather than relying on the index
+        attribute, so changing VECTOR_INDEX_EF_RUNTIME needs no rebuild.
+        """
+        config = self.index_config
+        if config is None or config.algorithm != "HNSW":
+            return None
+        return config.ef_runtime
+
+    async def find_similar(
+        self,
+        vector: list[float],
+        k=10,
+        ef_runtime: Optional[int] = None,
+        with_vectors: bool = False,
+    ) -> list[Document]:
+        """KNN lookup returning text, url and similarity.
+
+        `ef_runtime` defaults to the one of the index config. Vectors are left
+        out of the reply unless `with_vectors` is set; they are then read back
+        as raw FLOAT32 blobs in one extra pipelined round trip, since search
+        replies are decoded as text.
+        """
+        if ef_runtime is None:
+            ef_runtime = self.default_ef_runtime
+        result = await self.client.ft(INDEX_NAME).search(
+            self.knn_query(k, "text", "url", ef_runtime=ef_runtime),
+            {"query_vector": pack_vector(vector)},
+        )
+        chunks = result.docs  # type: ignore
+        vectors = [None] * len(chunks)
+        if with_vectors and chunks:
+            pipeline = self.client.pipeline(transaction=False)
+            for doc in chunks:
+                pipeline.hget(doc.id, "vector")
+            vectors = [unpack_vector(blob) for blob in await pipeline.execute()]
+
         documents = map(
-            lambda doc: Document(
+            lambda doc, vector: Document(
                 url=doc.url,
                 text=doc.text,
-                vector=json.loads(doc.vector),
+                vector=vector,
                 similarity=1 - float(doc.vector_score),
             ),
             chunks,
+            vectors,
         )
 
         return list(documents)
 
+    @staticmethod
+    def dedupe_batch(documents: list[Document]) -> list[Document]:
+        """Drops documents that are near duplicates of an earlier one in the same batch."""
+
+        vectors = normalize(np.array([document.vector for document in documents], dtype=np.float32))
+        similarity = vectors @ vectors.T
+
+        kept: list[int] = []
+        for i in range(len(documents)):
+            if not kept or similarity[i, kept].max() < DUPLICATE_THRESHOLD:
+                kept.append(i)
+        return [documents[i] for i in kept]
+
     async def get_insertables(self, documents: list[Document]) -> list[Document]:
-        insertables = []
+        """Keeps the documents that have no near duplicate in the batch or in the cache.
+
+        Duplicates inside the batch are found locally with one matrix product.
+        The remaining documents are checked against the cache with one KNN
+        probe each, all sent in a single pipeline round trip.
+        """
+
+        if not documents:
+            return []
+        documents = self.dedupe_batch(documents)
+
+        # The async search command cannot be queued on a pipeline (it only
+        # recognizes the sync Pipeline class), so the raw FT.SEARCH is queued
+        # and its reply parsed with Result below.
+        search = self.client.ft(INDEX_NAME)
+        pipeline = self.client.pipeline(transaction=False)
         for document in documents:
-            results = await self.find_similar(document.vector, k=1)
-            if not results:
-                insertables.append(document)
-            elif results[0].similarity < 0.97:
+            args, _ = search._mk_query_args(
+                self.knn_query(1, ef_runtime=self.default_ef_runtime),
+                {"query_vector": pack_vector(document.vector)},
+            )
+            pipeline.execute_command("FT.SEARCH", *args)
+        probes = await pipeline.execute()
+
+        insertables = []
+        for document, probe in zip(documents, probes):
+            nearest = Result(probe, hascontent=True).docs
+            if not nearest or 1 - float(nearest[0].vector_score) < DUPLICATE_THRESHOLD:
                 insertables.append(document)
         return insertables
 
@@ -77,44 +230,97 @@ class RedisVectorCache(VectorDbCache):
         documents = await self.get_insertables(documents)
         pipeline = self.client.pipeline()
         for document in documents:
-            SHA256.update(document.text.encode("utf-8"))
-            chunk_id = SHA256.hexdigest()
-            redis_key = f"chunks:{chunk_id}"
-            document.similarity = -1
-            pipeline.json().set(redis_key, "$", document.model_dump())
+            redis_key = chunk_key(document.text)
+            pipeline.hset(
+                redis_key,
+                mapping={
+                    "text": document.text,
+                    "url": document.url,
+                    "vector": pack_vector(document.vector),
+                },
+            )
             pipeline.expire(redis_key, 3600)
 
-        pipeline.execute()
+        await pipeline.execute()
 
-    def init_test(self):
+    async def init_test(self):
         df = pd.read_pickle("mocks/database_pickle")
-        df["vector"] = df["vector"].apply(lambda x: x.tolist()[0])
-        chunks = df.to_dict("records")
+        df["vector"] = df["vector"].apply(lambda x: pack_vector(x[0]))
+        chunks = df[["text", "url", "vector"]].to_dict("records")
 
         pipeline = self.client.pipeline()
         for chunk in chunks:
-            SHA256.update(chunk["text"].encode("utf-8"))
-            chunk_id = SHA256.hexdigest()
-            redis_key = f"chunks:{chunk_id}"
-            pipeline.json().set(redis_key, "$", chunk)
-        pipeline.execute()
+            pipeline.hset(chunk_key(chunk["text"]), mapping=chunk)
+        await pipeline.execute()
 
-    def init_index(self, vector_dimension):
+    async def create_index(
+        self,
+        name: str,
+        vector_dimension: int,
+        config: IndexConfig,
+        prefix: str = "chunks:",
+    ):
         schema = (
-            TextField("$.text", no_stem=True, as_name="text"),
-            TextField("$.url", no_stem=True, as_name="url"),
+            TextField("text", no_stem=True),
+            TextField("url", no_stem=True),
             VectorField(
-                "$.vector",
-                "FLAT",
-                {
-                    "TYPE": "FLOAT32",
-                    "DIM": vector_dimension,
-                    "DISTANCE_METRIC": "COSINE",
-                },
-                as_name="vector",
+                "vector",
+                config.algorithm,
+                config.vector_attributes(vector_dimension),
             ),
         )
-        definition = IndexDefinition(prefix=["chunks:"], index_type=IndexType.JSON)
-        self.client.ft("idx:chunks_vss").create_index(
-            fields=schema, definition=definition
-        )
+        definition = IndexDefinition(prefix=[prefix], index_type=IndexType.HASH)
+        await self.client.ft(name).create_index(fields=schema, definition=definition)
+
+    async def init_index(self, vector_dimension, config: IndexConfig = IndexConfig()):
+        """Creates the index described by `config` behind the INDEX_NAME alias. Fails if it exists."""
+
+        await self.create_index(config.index_name, vector_dimension, config)
+        await self.client.ft(config.index_name).aliasadd(INDEX_NAME)
+        self.index_config = config
+
+    async def wait_for_indexing(self, name: str, poll_interval: float = 0.5):
+        while True:
+            info = await self.client.ft(name).info()
+            if str(info["indexing"]) == "0" and float(info["percent_indexed"]) >= 1:
+                return
+            await asyncio.sleep(poll_interval)
+
+    async def migrate_index(self, vector_dimension, config: IndexConfig) -> str:
+        """Moves the INDEX_NAME alias to a new index without losing cached chunks.
+
+        The new index is built alongside the current one over the same keys,
+        and the alias is swapped once the backfill is done, so queries keep
+        being served by the old index until then. The old index is dropped
+        afterwards; the documents stay. An index created before aliases were
+        used is itself named INDEX_NAME and has to be dropped before the alias
+        can be added, which leaves a short window without an index. That
+        legacy index is over JSON documents, which the hash indexes never
+        see, so it is dropped together with them.
+        """
+
+        try:
+            await self.create_index(config.index_name, vector_dimension, config)
+        except redis.ResponseError as e:
+            if "already exists" not in str(e).lower():
+                raise
+        await self.wait_for_indexing(config.index_name)
+
+        try:
+            current = str((await self.client.ft(INDEX_NAME).info())["index_name"])
+        except redis.ResponseError:
+            current = None
+
+        if current == config.index_name:
+            self.index_config = config
+            return current
+        if current == INDEX_NAME:
+            await self.client.ft(INDEX_NAME).dropindex(delete_documents=True)
+            await self.client.ft(config.index_name).aliasadd(INDEX_NAME)
+        elif current is None:
+            await self.client.ft(config.index_name).aliasadd(INDEX_NAME)
+        else:
+            await self.client.ft(config.index_name).aliasupdate(INDEX_NAME)
+            await self.client.ft(current).dropindex(delete_documents=False)
+        self.index_config = config
+        return config.index_name
@@ -1,43 +1,429 @@
 from abc import ABC, abstractmethod
+import asyncio
+from collections import OrderedDict
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import json
-import aiohttp
+import os
+import random
+from typing import AsyncIterator, Optional
+import numpy as np
+import redis.asyncio as redis
 
 import openai
+from retrieval.http_client import get_session
+from util import logger
+
+MEMORY_CACHE_SIZE = 10_000
+REDIS_CACHE_TTL = 7 * 24 * 3600
+
+# Batches stay well under the provider's per-request limits. Tokens are
+# estimated at CHARS_PER_TOKEN, which is close for English text.
+BATCH_TOKENS = 8_000
+BATCH_SIZE = 256
+CHARS_PER_TOKEN = 4
+MAX_CONCURRENT_BATCHES = 4
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+
+# Local CPU model. One inference runs at a time, using LOCAL_THREADS
+# threads inside torch, so concurrent requests do not oversubscribe cores.
+LOCAL_MODEL = os.environ.get("LOCAL_EMBEDDINGS_MODEL", "all-MiniLM-L6-v2")
+LOCAL_BATCH_SIZE = 64
+LOCAL_THREADS = int(os.environ.get("LOCAL_EMBEDDINGS_THREADS", os.cpu_count() or 1))
+
+# Query embeddings requested within this window share one backend call.
+COALESCE_WINDOW = float(os.environ.get("EMBEDDINGS_COALESCE_WINDOW_MS", "5")) / 1000
 
 
 class Embeddings(ABC):
     """Abstraction of embeddings client."""
 
+    # Identifies the vector space; cached vectors are keyed by it.
+    model: str
+    vector_dimension: int
+
     @abstractmethod
     async def run(self, chunks: list[str]) -> list[list[float]]:
         pass
 
+    async def stream(
+        self, chunks: list[str]
+    ) -> AsyncIterator[tuple[int, list[list[float]]]]:
+        """Yields `(start, vectors)` as parts of `chunks` are embedded; `vectors[i]` is for `chunks[start + i]`."""
+        if chunks:
+            yield 0, await self.run(chunks)
+
 
 class RemoteEmbeddings(Embeddings):
     """Instanciates a client that implements _embeddings service."""
 
+    model = "remote-embeddings"
     vector_dimension = 384
 
     async def run(self, chunks: list[str]) -> list[list[float]]:
         url = f"http://embeddings/encode"
         headers = {"Content-Type": "application/json"}
         payload = json.dumps({"text": chunks})
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, data=payload, headers=headers) as response:
-                if response.status == 200:
-                    r = await response.json()
-                    return r["embedding"]
+        async with get_session().post(url, data=payload, headers=headers) as response:
+            if response.status == 200:
+                r = await response.json()
+                return r["embedding"]
         return [[]]
 
 
+class LocalEmbeddings(Embeddings):
+    """Runs a sentence-transformers model on the CPU, in process.
+
+    A drop-in for RemoteEmbeddings without the `embeddings` service: the
+    default all-MiniLM-L6-v2 model gives 384-dim vectors. The model is
+    loaded on first use, on the inference thread, and kept for the life of
+    the process. Needs `pip install sentence-transformers`.
+    """
+
+    vector_dimension = 384
+
+    def __init__(
+        self,
+        model: str = LOCAL_MODEL,
+        batch_size: int = LOCAL_BATCH_SIZE,
+        threads: int = LOCAL_THREADS,
+    ) -> None:
+        self.model = model
+        self.batch_size = batch_size
+        self.threads = threads
+        self.encoder = None
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="local-embeddings"
+        )
+
+    def load(self):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        torch.set_num_threads(self.threads)
+        self.encoder = SentenceTransformer(self.model, device="cpu")
+
+    def encode(self, chunks: list[str]) -> list[list[float]]:
+        if self.encoder is None:
+            self.load()
+        vectors = self.encoder.encode(  # type: ignore
+            chunks,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        )
+        return vectors.tolist()
+
+    async def run(self, chunks: list[str]) -> list[list[float]]:
+        if not chunks:
+            return []
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.encode, chunks)
+
+
 class OpenAIEmbeddings(Embeddings):
     """OpenAI embeddings client wrapper"""
 
+    model = "text-embedding-ada-002"
     vector_dimension = 1536
 
     async def run(
-        self, chunks: list[str], model="text-embedding-ada-002"
+        self, chunks: list[str], model: Optional[str] = None
     ) -> list[list[float]]:
-        response = await openai.Embedding.acreate(input=chunks, model=model)
+        response = await openai.Embedding.acreate(
+            input=chunks, model=model or self.model
+        )
         vectors = map(lambda x: x["embedding"], response["data"])  # type: ignore
         return list(vectors)
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings client that only sends texts it has not seen before to the backend.
+
+    Vectors are keyed by a hash of the backend's model and the text. Lookups
+    go to an in-process LRU first, then to Redis, which is shared by every
+    worker and keeps the vectors as packed FLOAT32 blobs. The misses are
+    embedded in one backend call, written to both tiers, and spliced back in
+    the order of the input. A `limiter` passed to `run` is only held around
+    that backend call, so texts that are all cached never wait for it.
+    """
+
+    def __init__(
+        self,
+        backend: Embeddings,
+        client: Optional[redis.Redis] = None,
+        memory_size: int = MEMORY_CACHE_SIZE,
+        ttl: int = REDIS_CACHE_TTL,
+    ) -> None:
+        self.backend = backend
+        self.model = backend.model
+        self.vector_dimension = backend.vector_dimension
+        self.client = client
+        self.memory_size = memory_size
+        self.ttl = ttl
+        self.memory: OrderedDict[str, list[float]] = OrderedDict()
+        self.texts = 0
+        self.memory_hits = 0
+        self.redis_hits = 0
+        self.backend_calls = 0
+        self.calls_saved = 0
+
+    def key(self, text: str) -> str:
+        digest = hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+        return f"embeddings:{digest}"
+
+    @property
+    def hit_ratio(self) -> float:
+        return (self.memory_hits + self.redis_hits) / self.texts if self.texts else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "texts": self.texts,
+            "memory_hits": self.memory_hits,
+            "redis_hits": self.redis_hits,
+            "hit_ratio": self.hit_ratio,
+            "backend_calls": self.backend_calls,
+            "backend_calls_saved": self.calls_saved,
+        }
+
+    def remember(self, key: str, vector: list[float]):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    async def read_redis(self, keys: list[str]) -> list[Optional[list[float]]]:
+        if self.client is None or not keys:
+            return [None] * len(keys)
+        try:
+            blobs = await self.client.mget(keys)
+        except redis.RedisError as e:
+            logger.warning(f"EMBEDDING CACHE UNAVAILABLE: {e}")
+            return [None] * len(keys)
+        return [
+            None if blob is None else np.frombuffer(blob, dtype=np.float32).tolist()
+            for blob in blobs
+        ]
+
+    async def write_redis(self, vectors: dict[str, list[float]]):
+        if self.client is None or not vectors:
+            return
+        pipeline = self.client.pipeline(transaction=False)
+        for key, vector in vectors.items():
+            pipeline.set(key, np.asarray(vector, dtype=np.float32).tobytes(), ex=self.ttl)
+        try:
+            await pipeline.execute()
+        except redis.RedisError as e:
+            logger.warning(f"EMBEDDING CACHE UNAVAILABLE: {e}")
+
+    async def run(
+        self, chunks: list[str], limiter: Optional[asyncio.Semaphore] = None
+    ) -> list[list[float]]:
+        if not chunks:
+            return []
+        keys = [self.key(chunk) for chunk in chunks]
+        found: dict[str, list[float]] = {}
+        for key in keys:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                found[key] = self.memory[key]
+        memory_hits = sum(key in found for key in keys)
+
+        lookups = list({key: None for key in keys if key not in found})
+        for key, vector in zip(lookups, await self.read_redis(lookups)):
+            if vector is not None:
+                found[key] = vector
+                self.remember(key, vector)
+        redis_hits = sum(key in found for key in keys) - memory_hits
+
+        misses = {key: chunk for key, chunk in zip(keys, chunks) if key not in found}
+        if misses:
+            async with limiter or nullcontext():
+                vectors = await self.backend.run(list(misses.values()))
+            embedded = {
+                key: vector for key, vector in zip(misses, vectors) if vector
+            }
+            for key, vector in embedded.items():
+                found[key] = vector
+                self.remember(key, vector)
+            await self.write_redis(embedded)
+            self.backend_calls += 1
+        else:
+            self.calls_saved += 1
+
+        self.texts += len(chunks)
+        self.memory_hits += memory_hits
+        self.redis_hits += redis_hits
+        logger.info(
+            f"EMBEDDING CACHE: {len(chunks) - len(misses)}/{len(chunks)} hits "
+            f"(memory {memory_hits}, redis {redis_hits}), "
+            f"overall hit ratio {self.hit_ratio:.2f}, "
+            f"backend calls saved {self.calls_saved}/{self.calls_saved + self.backend_calls}"
+        )
+        return [found.get(key, []) for key in keys]
+
+
+class EmbeddingDispatcher(Embeddings):
+    """Embeds large inputs in token-budgeted batches.
+
+    The texts are split, in order, into batches of at most `batch_tokens`
+    estimated tokens and `batch_size` texts. At most `concurrency` batches
+    are in flight at once, across all callers; over a `CachedEmbeddings`
+    backend only its calls to the provider count, not its cache lookups.
+    A failed batch is retried with exponential backoff; if it keeps
+    failing, only its texts are left without vectors. `stream` yields each
+    batch as soon as it is embedded.
+    """
+
+    def __init__(
+        self,
+        backend: Embeddings,
+        batch_tokens: int = BATCH_TOKENS,
+        batch_size: int = BATCH_SIZE,
+        concurrency: int = MAX_CONCURRENT_BATCHES,
+        retries: int = MAX_RETRIES,
+        backoff: float = RETRY_BACKOFF,
+    ) -> None:
+        self.backend = backend
+        self.model = backend.model
+        self.vector_dimension = backend.vector_dimension
+        self.batch_tokens = batch_tokens
+        self.batch_size = batch_size
+        self.retries = retries
+        self.backoff = backoff
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        return len(text) // CHARS_PER_TOKEN + 1
+
+    def batches(self, chunks: list[str]) -> list[tuple[int, int]]:
+        """`(start, end)` ranges of `chunks`; a text over the budget gets a batch of its own."""
+        ranges = []
+        start, tokens = 0, 0
+        for i, chunk in enumerate(chunks):
+            size = self.estimate_tokens(chunk)
+            if i > start and (
+                tokens + size > self.batch_tokens or i - start >= self.batch_size
+            ):
+                ranges.append((start, i))
+                start, tokens = i, 0
+            tokens += size
+        if start < len(chunks):
+            ranges.append((start, len(chunks)))
+        return ranges
+
+    async def embed_batch(
+        self, start: int, batch: list[str]
+    ) -> tuple[int, list[list[float]]]:
+        for attempt in range(self.retries + 1):
+            try:
+                if isinstance(self.backend, CachedEmbeddings):
+                    vectors = await self.backend.run(batch, limiter=self.semaphore)
+                else:
+                    async with self.semaphore:
+                        vectors = await self.backend.run(batch)
+                if len(vectors) == len(batch) and all(vectors):
+                    return start, vectors
+                error = f"got {len(vectors)} vectors for {len(batch)} texts"
+            except Exception as e:
+                error = repr(e)
+            if attempt < self.retries:
+                delay = self.backoff * 2**attempt * random.uniform(0.5, 1.5)
+                logger.warning(
+                    f"EMBEDDING BATCH FAILED ({error}), retrying in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+        logger.error(f"EMBEDDING BATCH DROPPED after {self.retries + 1} attempts: {error}")
+        return start, [[] for _ in batch]
+
+    async def stream(
+        self, chunks: list[str]
+    ) -> AsyncIterator[tuple[int, list[list[float]]]]:
+        tasks = [
+            asyncio.create_task(self.embed_batch(start, chunks[start:end]))
+            for start, end in self.batches(chunks)
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def run(self, chunks: list[str]) -> list[list[float]]:
+        vectors: list[list[float]] = [[] for _ in chunks]
+        async for start, batch in self.stream(chunks):
+            vectors[start : start + len(batch)] = batch
+        return vectors
+
+
+class CoalescingEmbeddings(Embeddings):
+    """Groups small embedding requests from concurrent callers into shared batches.
+
+    The first text to arrive opens a window of `window` seconds; every text
+    requested until it closes, or until `max_batch` distinct texts are
+    waiting, is embedded in one backend call and the vectors are handed back
+    to each caller. A text that is already waiting or being embedded is not
+    sent again. Meant for query embeddings, one short text per request.
+    """
+
+    def __init__(
+        self,
+        backend: Embeddings,
+        window: float = COALESCE_WINDOW,
+        max_batch: int = BATCH_SIZE,
+    ) -> None:
+        self.backend = backend
+        self.model = backend.model
+        self.vector_dimension = backend.vector_dimension
+        self.window = window
+        self.max_batch = max_batch
+        self.pending: dict[str, asyncio.Future] = {}
+        self.in_flight: dict[str, asyncio.Future] = {}
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.tasks: set[asyncio.Task] = set()
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, {}
+        self.in_flight.update(batch)
+        task = asyncio.create_task(self.embed(batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def embed(self, batch: dict[str, asyncio.Future]):
+        try:
+            vectors = await self.backend.run(list(batch))
+        except Exception as e:
+            vectors, error = [], e
+        else:
+            error = None
+        for i, (text, future) in enumerate(batch.items()):
+            del self.in_flight[text]
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(vectors[i] if i < len(vectors) else [])
+
+    async def run(self, chunks: list[str]) -> list[list[float]]:
+        loop = asyncio.get_running_loop()
+        futures = []
+        for chunk in chunks:
+            future = self.pending.get(chunk) or self.in_flight.get(chunk)
+            if future is None:
+                future = self.pending[chunk] = loop.create_future()
+                if len(self.pending) >= self.max_batch:
+                    self.flush()
+                elif self.timer is None:
+                    self.timer = loop.call_later(self.window, self.flush)
+            futures.append(future)
+        # Shielded, so a caller that goes away does not cancel the vector
+        # other callers are waiting on.
+        return list(await asyncio.gather(*map(asyncio.shield, futures)))
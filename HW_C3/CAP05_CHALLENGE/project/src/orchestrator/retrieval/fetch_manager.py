@@ -0,0 +1,89 @@
+import asyncio
+import os
+import time
+from typing import Any, AsyncIterator
+
+from retrieval.scraper import Scraper
+from util import logger
+
+# All the fetches for one query share FETCH_BUDGET seconds. Fetching stops
+# early once FETCH_ENOUGH_PAGES pages with at least MIN_PAGE_TEXT characters
+# have arrived. A URL still loading after FETCH_HEDGE_AFTER seconds gets a
+# second, parallel fetch; the first one to return a page wins.
+FETCH_BUDGET = float(os.environ.get("FETCH_BUDGET", 6))
+FETCH_ENOUGH_PAGES = int(os.environ.get("FETCH_ENOUGH_PAGES", 5))
+FETCH_HEDGE_AFTER = float(os.environ.get("FETCH_HEDGE_AFTER", 1.5))
+MIN_PAGE_TEXT = 200
+
+
+class FetchManager:
+    """Fetches the pages of a set of search results under one time budget.
+
+    Pages are yielded in completion order. When the budget runs out, or
+    enough good pages have arrived, the fetches still running are
+    cancelled, so a slow site cannot hold up the query.
+    """
+
+    def __init__(
+        self,
+        scraper: Scraper,
+        budget: float = FETCH_BUDGET,
+        enough_pages: int = FETCH_ENOUGH_PAGES,
+        hedge_after: float = FETCH_HEDGE_AFTER,
+        min_text: int = MIN_PAGE_TEXT,
+    ) -> None:
+        self.scraper = scraper
+        self.budget = budget
+        self.enough_pages = enough_pages
+        self.hedge_after = hedge_after
+        self.min_text = min_text
+
+    async def fetch_hedged(self, url: str) -> dict[str, Any]:
+        """Fetches `url`, starting a backup fetch if the first is still running after `hedge_after`."""
+
+        tasks = {asyncio.create_task(self.scraper.fetch(url))}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+            if not done:
+                logger.info(f"HEDGED FETCH: {url}")
+                tasks.add(asyncio.create_task(self.scraper.fetch(url)))
+            while tasks:
+                done, tasks = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None and task.result()["text"]:
+                        return task.result()
+            return {"url": url, "text": None}
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def pages(self, urls: list[str]) -> AsyncIterator[dict[str, Any]]:
+        """Yields the pages that have text, until all are in, enough are good, or the budget is spent."""
+
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(self.fetch_hedged(url)) for url in urls]
+        good = 0
+        try:
+            for next_page in asyncio.as_completed(tasks, timeout=self.budget):
+                try:
+                    page = await next_page
+                except asyncio.TimeoutError:
+                    logger.info(f"FETCH BUDGET SPENT after {self.budget}s")
+                    break
+                if not page["text"]:
+                    continue
+                yield page
+                if len(page["text"]) >= self.min_text:
+                    good += 1
+                    if good >= self.enough_pages:
+                        break
+        finally:
+            cancelled = sum(not task.done() for task in tasks)
+            for task in tasks:
+                task.cancel()
+            logger.info(
+                f"FETCH: {good} good pages of {len(urls)}, {cancelled} cancelled, "
+                f"{time.perf_counter() - start:.2f}s"
+            )
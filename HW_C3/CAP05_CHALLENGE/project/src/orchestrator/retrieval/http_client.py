@@ -0,0 +1,39 @@
+from typing import Optional
+import aiohttp
+
+# Connections are kept alive and reused across requests; MAX_CONNECTIONS
+# bounds all of them and MAX_CONNECTIONS_PER_HOST keeps one slow site from
+# taking the whole pool. Resolved addresses are cached for DNS_CACHE_TTL.
+MAX_CONNECTIONS = 100
+MAX_CONNECTIONS_PER_HOST = 10
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 30
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    """The HTTP session shared by the scrapers, the searcher and the embeddings clients.
+
+    It is created on first use, inside the running event loop, and closed by
+    `close_session` when the app shuts down.
+    """
+
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=MAX_CONNECTIONS,
+            limit_per_host=MAX_CONNECTIONS_PER_HOST,
+            use_dns_cache=True,
+            ttl_dns_cache=DNS_CACHE_TTL,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+        )
+        _session = aiohttp.ClientSession(connector=connector)
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
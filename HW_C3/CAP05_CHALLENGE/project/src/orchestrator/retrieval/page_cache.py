@@ -0,0 +1,109 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import os
+import time
+from typing import Any, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Pages younger than PAGE_CACHE_MAX_AGE are served without a request; older
+# ones are revalidated with their ETag / Last-Modified. The least recently
+# used pages are evicted once the cached text exceeds PAGE_CACHE_BYTES.
+PAGE_CACHE_MAX_AGE = int(os.environ.get("PAGE_CACHE_MAX_AGE", 600))
+PAGE_CACHE_BYTES = int(os.environ.get("PAGE_CACHE_BYTES", 64 * 1024 * 1024))
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def canonical_url(url: str) -> str:
+    """Same key for URLs that differ only in case of scheme and host, default port, fragment or query order."""
+
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, parts.path or "/", query, ""))
+
+
+@dataclass
+class CachedPage:
+    text: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    checked_at: float
+    # Splits of `text`, filled in by the retriever the first time it splits it.
+    chunks: Optional[list[str]] = None
+
+    @property
+    def size(self) -> int:
+        return len(self.text) + sum(map(len, self.chunks or ()))
+
+    def validators(self) -> dict[str, str]:
+        """Headers for a conditional request."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def as_page(self, url: str) -> dict[str, Any]:
+        return {"url": url, "text": self.text, "chunks": self.chunks}
+
+
+class PageCache:
+    """Extracted page text, keyed by canonical URL, with the validators to revalidate it."""
+
+    def __init__(
+        self, max_age: float = PAGE_CACHE_MAX_AGE, max_bytes: int = PAGE_CACHE_BYTES
+    ) -> None:
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.pages: OrderedDict[str, CachedPage] = OrderedDict()
+        self.size = 0
+
+    def get(self, url: str) -> Optional[CachedPage]:
+        key = canonical_url(url)
+        page = self.pages.get(key)
+        if page is not None:
+            self.pages.move_to_end(key)
+        return page
+
+    def is_fresh(self, page: CachedPage) -> bool:
+        return time.monotonic() - page.checked_at < self.max_age
+
+    def revalidated(self, page: CachedPage):
+        page.checked_at = time.monotonic()
+
+    def put(
+        self,
+        url: str,
+        text: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> CachedPage:
+        self.discard(url)
+        page = CachedPage(text, etag, last_modified, time.monotonic())
+        self.pages[canonical_url(url)] = page
+        self.size += page.size
+        self.evict()
+        return page
+
+    def set_chunks(self, url: str, chunks: list[str]):
+        page = self.pages.get(canonical_url(url))
+        if page is not None and page.chunks is None:
+            self.size -= page.size
+            page.chunks = chunks
+            self.size += page.size
+            self.evict()
+
+    def discard(self, url: str):
+        page = self.pages.pop(canonical_url(url), None)
+        if page is not None:
+            self.size -= page.size
+
+    def evict(self):
+        while self.size > self.max_bytes and self.pages:
+            _, page = self.pages.popitem(last=False)
+            self.size -= page.size
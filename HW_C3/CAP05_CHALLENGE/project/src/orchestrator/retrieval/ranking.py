@@ -0,0 +1,28 @@
+import numpy as np
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Scales the rows of a float32 matrix to unit length, in place. Zero rows stay zero."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    vectors /= np.where(norms == 0, 1, norms)
+    return vectors
+
+
+def top_k(query_vector, vectors, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Indices and cosine similarities of the `k` rows closest to the query, best first.
+
+    The rows are stacked into one float32 matrix and normalized once, every
+    score comes from a single matrix-vector product, and `argpartition`
+    selects the top k in linear time so only those k are sorted.
+    """
+
+    matrix = normalize(np.array(vectors, dtype=np.float32))
+    query = normalize(np.array(query_vector, dtype=np.float32).reshape(-1))
+    scores = matrix @ query
+
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+    best = np.argpartition(-scores, k - 1)[:k]
+    best = best[np.argsort(-scores[best])]
+    return best, scores[best]
@@ -1,9 +1,10 @@
 import asyncio
+from collections import defaultdict
+from contextlib import aclosing, contextmanager
 import json
+import os
 import time
-from typing import Any, AsyncGenerator
-import numpy as np
-import pandas as pd
+from typing import AsyncGenerator, Optional
 from util import logger
 from models.document import Document
 from retrieval.search import Searcher
@@ -11,9 +12,48 @@ from retrieval.cache import VectorDbCache
 from retrieval.splitter import Splitter
 from retrieval.scraper import Scraper
 from retrieval.embeddings import Embeddings
-from sklearn.metrics.pairwise import cosine_similarity
+from retrieval.fetch_manager import FetchManager
+from retrieval.ranking import top_k
 from models.search import SearchDoc, SearchResult
 
+# Ranking uses whatever pages were split and embedded by this many seconds
+# after the search results came in; the rest of the work is cancelled.
+RETRIEVAL_DEADLINE = float(os.environ.get("RETRIEVAL_DEADLINE", 10))
+
+
+class StageTimings:
+    """Busy time of each pipeline stage, and when each one finished, from the start of the pipeline.
+
+    A stage cut off by the deadline has no finish time.
+    """
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.busy: defaultdict[str, float] = defaultdict(float)
+        self.finished: dict[str, float] = {}
+
+    @contextmanager
+    def measure(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.busy[stage] += time.perf_counter() - start
+
+    def finish(self, stage: str):
+        self.finished[stage] = time.perf_counter() - self.start
+
+    def summary(self) -> dict[str, dict[str, Optional[float]]]:
+        return {
+            stage: {
+                "busy": round(self.busy.get(stage, 0.0), 3),
+                "finished": round(self.finished[stage], 3)
+                if stage in self.finished
+                else None,
+            }
+            for stage in dict.fromkeys([*self.busy, *self.finished])
+        }
+
 
 class Retriever:
     def __init__(
@@ -23,19 +63,23 @@ class Retriever:
         scraper: Scraper,
         embeddings: Embeddings,
         splitter: Splitter,
+        query_embeddings: Optional[Embeddings] = None,
+        fetcher: Optional[FetchManager] = None,
     ) -> None:
         self.cache = cache
         self.searcher = searcher
         self.scraper = scraper
         self.embeddings = embeddings
         self.splitter = splitter
+        self.query_embeddings = query_embeddings or embeddings
+        self.fetcher = fetcher or FetchManager(scraper)
 
     async def get_context(
         self, query: str, cache_treshold: float = 0.85, k: int = 10
     ) -> AsyncGenerator[dict, None]:
         """Generates context based on query. It can retrieve from cache or from internet."""
 
-        query_vector = await self.embeddings.run([query])
+        query_vector = await self.query_embeddings.run([query])
         documents = await self.cache.find_similar(query_vector[0], k)
         quality_cache = await self.evaluate_retrieval(documents, cache_treshold)
 
@@ -58,42 +102,116 @@ class Retriever:
         yield {"event": "context", "data": context}
 
     async def search_for_documents(
-        self, search_results, query_vector, k
+        self, search_results, query_vector, k, deadline: float = RETRIEVAL_DEADLINE
     ) -> list[Document]:
-        """Searches for relevant information on the internet."""
+        """Searches for relevant information on the internet.
 
-        start = time.perf_counter()
+        Pages go through the stages as soon as they land, each stage linked
+        to the next by a queue: fetch -> split -> embed -> rank. Ranking
+        keeps the best k chunks seen so far, so when `deadline` expires the
+        unfinished work is cancelled and the current best k are returned.
+        """
+
+        timings = StageTimings()
+        pages: asyncio.Queue = asyncio.Queue()
+        splits: asyncio.Queue = asyncio.Queue()
+        embedded: asyncio.Queue = asyncio.Queue()
+        relevant_documents: list[Document] = []
+        counts = {"pages": 0, "chunks": 0}
 
-        results = search_results.model_dump()
-        tasks = [self.scraper.fetch(item["link"]) for item in results["items"]]
-        pages = await asyncio.gather(*tasks)
+        async def fetch_stage():
+            urls = [item.link for item in search_results.items]
+            try:
+                async with aclosing(self.fetcher.pages(urls)) as fetched:
+                    async for page in fetched:
+                        if "first page" not in timings.finished:
+                            timings.finish("first page")
+                        await pages.put(page)
+                timings.finish("fetch")
+            finally:
+                await pages.put(None)
 
-        end = time.perf_counter()
-        logger.info(f"SCRAPE TIME: {end - start}")
+        async def split_stage():
+            try:
+                while (page := await pages.get()) is not None:
+                    # Pages the scraper found unchanged come with their chunks;
+                    # their vectors are then in the embeddings cache too.
+                    chunks = page.get("chunks")
+                    if chunks is None:
+                        with timings.measure("split"):
+                            chunks = await self.splitter.split(page["text"])
+                        self.scraper.remember_chunks(page["url"], chunks)
+                    counts["pages"] += 1
+                    counts["chunks"] += len(chunks)
+                    await splits.put(
+                        [{"text": chunk, "url": page["url"]} for chunk in chunks]
+                    )
+                timings.finish("split")
+            finally:
+                await splits.put(None)
 
-        documents = []
-        page_count = 0
-        for page in pages:
-            if page["text"]:
-                page_count += 1
-                splits = await self.splitter.split(page["text"])
-                for split in splits:
-                    documents.append({"text": split, "url": page["url"]})
+        async def embed_page(documents):
+            texts = [doc["text"] for doc in documents]
+            with timings.measure("embed"):
+                async for start, vectors in self.embeddings.stream(texts):
+                    await embedded.put(
+                        [
+                            {**documents[start + i], "vector": vector}
+                            for i, vector in enumerate(vectors)
+                            if vector
+                        ]
+                    )
 
-        logger.info(f"SCRAPED PAGES: {page_count}")
-        logger.info(f"SPLIT COUNT: {len(documents)}")
+        async def embed_stage():
+            tasks = []
+            try:
+                while (documents := await splits.get()) is not None:
+                    tasks.append(asyncio.create_task(embed_page(documents)))
+                await asyncio.gather(*tasks)
+                timings.finish("embed")
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await embedded.put(None)
 
-        embedding_start_time = time.perf_counter()
-        texts = [doc["text"] for doc in documents]
-        embeddings = await self.embeddings.run(texts)
+        async def rank_stage():
+            nonlocal relevant_documents
+            while (batch := await embedded.get()) is not None:
+                with timings.measure("rank"):
+                    candidates = [doc.model_dump() for doc in relevant_documents]
+                    relevant_documents = await self.get_most_similar(
+                        query_vector, candidates + batch, k
+                    )
+            timings.finish("rank")
+
+        stages = [
+            asyncio.create_task(stage())
+            for stage in (fetch_stage, split_stage, embed_stage, rank_stage)
+        ]
+        # A failing stage stops the pipeline at once instead of leaving the
+        # others waiting for the deadline; what was ranked so far is kept.
+        try:
+            done, unfinished = await asyncio.wait(
+                stages, timeout=deadline, return_when=asyncio.FIRST_EXCEPTION
+            )
+            failed = any(not task.cancelled() and task.exception() for task in done)
+            if unfinished and not failed:
+                logger.info(f"RETRIEVAL DEADLINE: ranked what finished in {deadline}s")
+        finally:
+            for stage in stages:
+                stage.cancel()
+            results = await asyncio.gather(*stages, return_exceptions=True)
 
-        for i, vector in enumerate(embeddings):
-            documents[i]["vector"] = vector
+        for stage, result in zip(("fetch", "split", "embed", "rank"), results):
+            if isinstance(result, Exception):
+                logger.error(
+                    f"RETRIEVAL STAGE FAILED: {stage}: {result!r}", exc_info=result
+                )
 
-        embedding_time = time.perf_counter() - embedding_start_time
-        logger.info(f"EMBEDDING TIME: {embedding_time}")
+        logger.info(f"SCRAPED PAGES: {counts['pages']}")
+        logger.info(f"SPLIT COUNT: {counts['chunks']}")
+        logger.info(f"STAGE TIMINGS: {timings.summary()}")
 
-        relevant_documents = await self.get_most_similar(query_vector, documents, k)
         mean_score = await self.get_mean_similarity(relevant_documents)
 
         logger.info(f"RETRIEVAL SCORE: {mean_score}")
@@ -102,20 +220,19 @@ class Retriever:
     async def get_most_similar(self, query_vector, data, k=5) -> list[Document]:
         """Get most relevant texts based on cosine similarity"""
 
-        query_vector = np.array(query_vector).reshape(1, -1)
+        if not data:
+            return []
 
-        def compute_cosine_similarity(row):
-            return cosine_similarity(query_vector, row)[0][0]
-
-        df: Any = pd.DataFrame(data)
-        df["vector"] = df["vector"].apply(lambda x: np.array(x).reshape(1, -1))
-        df["similarity"] = df["vector"].apply(compute_cosine_similarity)
-        similar = df.nlargest(k, "similarity")[["text", "url", "vector", "similarity"]]
-        similar["vector"] = similar["vector"].apply(lambda x: x[0].tolist())
-
-        json_docs = similar.to_dict("records")
-
-        return [Document(**json_doc) for json_doc in json_docs]
+        indices, scores = top_k(query_vector, [doc["vector"] for doc in data], k)
+        return [
+            Document(
+                text=data[i]["text"],
+                url=data[i]["url"],
+                vector=data[i]["vector"],
+                similarity=float(score),
+            )
+            for i, score in zip(indices, scores)
+        ]
 
     async def evaluate_retrieval(
         self, documents: list[Document], treshold: float
@@ -1,9 +1,133 @@
 from abc import ABC, abstractmethod
+import asyncio
+import codecs
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
 import re
-from typing import Any
+import time
+from typing import Any, Optional
 
 import aiohttp
-from bs4 import BeautifulSoup
+import charset_normalizer
+from lxml import etree, html
+
+from retrieval.http_client import get_session
+from retrieval.page_cache import PageCache
+from util import logger
+
+# Bodies are streamed and cut at MAX_PAGE_BYTES, so a huge page costs at
+# most that much memory and download time; the text at the top of a page
+# is the part worth keeping anyway.
+MAX_PAGE_BYTES = int(os.environ.get("SCRAPER_MAX_PAGE_BYTES", 2 * 1024 * 1024))
+READ_CHUNK_SIZE = 64 * 1024
+FETCH_TIMEOUT = 5
+TEXT_CONTENT_TYPES = ("text/html", "application/xhtml+xml", "text/plain")
+# A <meta charset> has to be in the first 1024 bytes of a document. Among
+# equally likely detected encodings, undeclared pages get the web's default.
+WEB_DEFAULT_ENCODING = "cp1252"
+META_CHARSET = re.compile(rb"""<meta[^>]*charset\s*=\s*["']?([\w.:-]+)""", re.IGNORECASE)
+
+# Text extraction is CPU bound, so it runs in worker processes and never
+# blocks the event loop. The workers are started by a fork server: by the
+# time the pool is needed the server process runs threads (DNS resolver,
+# embedding executor, torch pools), and forking it could deadlock a child.
+# The fork server imports this module once, so the workers do not each
+# import the retrieval package again.
+# Elements that hold no readable content, or only
+# site chrome, are dropped before the text is collected. `header` and `form`
+# are kept: articles put their title in a header, and ASP.NET pages wrap
+# the whole body in one form.
+PARSE_WORKERS = int(os.environ.get("SCRAPER_PARSE_WORKERS", os.cpu_count() or 1))
+BOILERPLATE_TAGS = (
+    "script",
+    "style",
+    "noscript",
+    "template",
+    "svg",
+    "iframe",
+    "nav",
+    "footer",
+    "aside",
+)
+HTML_PARSER = html.HTMLParser(encoding="utf-8", remove_comments=True, remove_pis=True)
+
+_parse_pool: Optional[ProcessPoolExecutor] = None
+
+
+def extract_text(body: str) -> str:
+    """Readable text of an HTML document, without boilerplate elements."""
+
+    try:
+        tree = html.fromstring(body.encode("utf-8"), parser=HTML_PARSER)
+    except etree.ParserError:
+        return ""
+    etree.strip_elements(tree, *BOILERPLATE_TAGS, with_tail=False)
+    raw_text = " ".join(
+        stripped for text in tree.itertext() if (stripped := text.strip())
+    )
+    return re.sub(r"\n{3,}|\s{2,}", "\n", raw_text)
+
+
+def decode_body(body: bytes) -> str:
+    """Decodes a body sent without a charset in its Content-Type.
+
+    The document's own <meta charset> wins; otherwise the encoding is
+    detected, as aiohttp's `text()` does. Single-byte encodings often tie
+    on Spanish text, and windows-1252 is then the likely one.
+    """
+
+    match = META_CHARSET.search(body, 0, 1024)
+    encoding = match.group(1).decode("ascii") if match else None
+    if encoding is not None:
+        try:
+            codecs.lookup(encoding)
+        except LookupError:
+            encoding = None
+    if encoding is None:
+        matches = charset_normalizer.from_bytes(body)
+        best = matches.best()
+        tied = [
+            match.encoding
+            for match in matches
+            if best is not None
+            and (match.chaos, match.coherence) == (best.chaos, best.coherence)
+        ]
+        if WEB_DEFAULT_ENCODING in tied:
+            encoding = WEB_DEFAULT_ENCODING
+        else:
+            encoding = best.encoding if best is not None else "utf-8"
+    return body.decode(encoding, errors="replace")
+
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    global _parse_pool
+    if _parse_pool is None:
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([__name__])
+        _parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=context)
+    return _parse_pool
+
+
+async def start_parse_pool():
+    """Starts every worker of the pool, so the first queries do not pay for it.
+
+    The pool only starts a worker when none is idle, so each warm-up call
+    keeps its worker busy for a moment.
+    """
+
+    loop = asyncio.get_running_loop()
+    pool = get_parse_pool()
+    await asyncio.gather(
+        *(loop.run_in_executor(pool, time.sleep, 0.2) for _ in range(PARSE_WORKERS))
+    )
+
+
+def close_parse_pool():
+    global _parse_pool
+    if _parse_pool is not None:
+        _parse_pool.shutdown(cancel_futures=True)
+        _parse_pool = None
 
 
 class Scraper(ABC):
@@ -11,13 +135,14 @@ class Scraper(ABC):
     async def fetch(self, url: str) -> dict[str, Any]:
         pass
 
+    def remember_chunks(self, url: str, chunks: list[str]):
+        """Called with the splits of a fetched page, for scrapers that cache pages."""
+
     async def parse(self, body):
-        """Parses all the text from the html."""
+        """Parses all the text from the html, in a worker process."""
 
-        soup = BeautifulSoup(body, "html.parser")
-        raw_text = soup.get_text(separator=" ", strip=True)
-        text = re.sub(r"\n{3,}|\s{2,}", "\n", raw_text)
-        return text
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_parse_pool(), extract_text, body)
 
 
 class ScraperRemote(Scraper):
@@ -25,24 +150,107 @@ class ScraperRemote(Scraper):
         self.host = host
 
     async def fetch(self, url: str) -> dict[str, Any]:
-        async with aiohttp.ClientSession() as session:
-            query_url = self.host + url
-            async with session.post(query_url) as response:
-                if response.status == 200:
-                    body = await response.json()
-                    text = await self.parse(body["html"])
-                    if text:
-                        return {"url": url, "text": text}
-            return {"url": url, "text": None}
+        query_url = self.host + url
+        async with get_session().post(query_url) as response:
+            if response.status == 200:
+                body = await response.json()
+                text = await self.parse(body["html"])
+                if text:
+                    return {"url": url, "text": text}
+        return {"url": url, "text": None}
 
 
 class ScraperLocal(Scraper):
+    """Fetches pages directly.
+
+    With a `cache`, pages fetched recently are served from it and older ones
+    are revalidated with a conditional request; an unchanged page comes back
+    with the chunks it was split into the first time.
+    """
+
+    def __init__(
+        self, max_bytes: int = MAX_PAGE_BYTES, cache: Optional[PageCache] = None
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.cache = cache
+
     async def fetch(self, url):
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                url, timeout=aiohttp.ClientTimeout(total=5)
-            ) as response:
-                html = await response.text()
-                text = await self.parse(html)
-
-                return {"url": url, "text": text}
+        """Never raises on network errors or timeouts; the page comes back with text None."""
+
+        try:
+            return await self.fetch_page(url)
+        except (aiohttp.ClientError, asyncio.TimeoutError, UnicodeError) as e:
+            logger.info(f"SCRAPE FAILED {url}: {e!r}")
+            return {"url": url, "text": None}
+
+    async def fetch_page(self, url):
+        cached = self.cache.get(url) if self.cache is not None else None
+        if cached is not None and self.cache.is_fresh(cached):  # type: ignore
+            return cached.as_page(url)
+
+        async with get_session().get(
+            url,
+            headers=cached.validators() if cached is not None else None,
+            timeout=aiohttp.ClientTimeout(total=FETCH_TIMEOUT),
+        ) as response:
+            if response.status == 304 and cached is not None:
+                self.cache.revalidated(cached)  # type: ignore
+                return cached.as_page(url)
+            if response.status >= 400:
+                logger.info(f"SCRAPE FAILED {url}: HTTP {response.status}")
+                return {"url": url, "text": None}
+            if response.content_type not in TEXT_CONTENT_TYPES:
+                logger.info(f"SKIPPED {response.content_type}: {url}")
+                return {"url": url, "text": None}
+            html = await self.read_text(response)
+            cacheable = response.status == 200 and "no-store" not in response.headers.get(
+                "Cache-Control", ""
+            )
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+
+        text = await self.parse(html)
+        if self.cache is not None:
+            if cacheable and text:
+                self.cache.put(url, text, etag, last_modified)
+            else:
+                self.cache.discard(url)
+        return {"url": url, "text": text}
+
+    def remember_chunks(self, url: str, chunks: list[str]):
+        if self.cache is not None:
+            self.cache.set_chunks(url, chunks)
+
+    async def read_blocks(self, response: aiohttp.ClientResponse):
+        """Streams the body and stops reading after `max_bytes`.
+
+        Leaving the response unread closes its connection, so the rest of
+        the body is never downloaded.
+        """
+
+        size = 0
+        async for block in response.content.iter_chunked(READ_CHUNK_SIZE):
+            block = block[: self.max_bytes - size]
+            size += len(block)
+            yield block
+            if size >= self.max_bytes:
+                break
+
+    async def read_text(self, response: aiohttp.ClientResponse) -> str:
+        """Decodes the body as it streams in, with the charset of the response.
+
+        Without one, the capped body is collected and decoded by `decode_body`.
+        """
+
+        if response.charset is None:
+            blocks = [block async for block in self.read_blocks(response)]
+            return decode_body(b"".join(blocks))
+        try:
+            decoder = codecs.getincrementaldecoder(response.charset)
+        except LookupError:
+            decoder = codecs.getincrementaldecoder("utf-8")
+        decode = decoder(errors="replace").decode
+
+        parts = [decode(block) async for block in self.read_blocks(response)]
+        parts.append(decode(b"", final=True))
+        return "".join(parts)
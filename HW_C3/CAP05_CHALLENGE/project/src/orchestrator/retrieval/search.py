@@ -2,7 +2,7 @@ from abc import ABC, abstractmethod
 import os
 from urllib.parse import urlencode
 from models.search import SearchResult
-import aiohttp
+from retrieval.http_client import get_session
 
 from mocks.test_dict import provisional_search_result
 
@@ -39,14 +39,13 @@ class GoogleAPI(Searcher):
         )
         url = f"{GOOGLE_API_URL}{query_params}"
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                url,
-                headers=REQUEST_HEADERS,
-            ) as response:
-                r = await response.json()
-                try:
-                    return SearchResult(**r)
-                except Exception as e:
-                    print("SEARCHER", e)
-                    return SearchResult(**provisional_search_result)
+        async with get_session().get(
+            url,
+            headers=REQUEST_HEADERS,
+        ) as response:
+            r = await response.json()
+            try:
+                return SearchResult(**r)
+            except Exception as e:
+                print("SEARCHER", e)
+                return SearchResult(**provisional_search_result)
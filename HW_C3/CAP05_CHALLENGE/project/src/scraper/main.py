@@ -1,38 +1,350 @@
+import asyncio
+from collections import deque
+import os
+import re
 import time
+from typing import Optional
+from urllib.parse import urlsplit
 from fastapi import FastAPI, HTTPException
-from playwright.async_api import async_playwright
+from playwright.async_api import Browser, Playwright, Route, async_playwright
 from playwright._impl._api_types import TimeoutError
 from contextlib import asynccontextmanager
 import logging
 import aiohttp
+import psutil
 
 logger = logging.getLogger(__name__)
-app = FastAPI()
 
+# BROWSER_POOL_SIZE warm browsers serve at most BROWSER_PAGES pages each at
+# a time; requests beyond that wait up to POOL_TIMEOUT seconds for a slot.
+# A browser is replaced after BROWSER_RECYCLE_PAGES pages, or when the
+# browsers together use more than BROWSER_RECYCLE_MB of memory. Their
+# memory is sampled every BROWSER_MEMORY_INTERVAL seconds in a background
+# task, since it takes a scan of every browser process.
+BROWSER_POOL_SIZE = int(os.environ.get("BROWSER_POOL_SIZE", 2))
+BROWSER_PAGES = int(os.environ.get("BROWSER_PAGES", 4))
+BROWSER_RECYCLE_PAGES = int(os.environ.get("BROWSER_RECYCLE_PAGES", 200))
+BROWSER_RECYCLE_MB = int(os.environ.get("BROWSER_RECYCLE_MB", 1536))
+BROWSER_MEMORY_INTERVAL = float(os.environ.get("BROWSER_MEMORY_INTERVAL", 5))
+POOL_TIMEOUT = 10
+WAIT_SAMPLES = 1000
 
-async def fetch_check_js(url):
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, timeout=aiohttp.ClientTimeout(total=3)) as response:
-            html = await response.text()
+# A page is first fetched without a browser. It is rendered in a browser
+# only if it looks like a JavaScript shell: little visible text, or an
+# empty app mount point or a "please enable JavaScript" notice with not
+# much text around it.
+STATIC_FETCH_TIMEOUT = 3
+MIN_STATIC_TEXT = int(os.environ.get("MIN_STATIC_TEXT", 500))
+SHELL_MAX_TEXT = 2000
+HIDDEN_ELEMENTS = re.compile(
+    r"<(script|style|noscript|template)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL
+)
+TAGS = re.compile(r"<[^>]+>")
+EMPTY_MOUNT_POINT = re.compile(
+    r"<div[^>]+id=[\"'](root|app|__next|__nuxt)[\"'][^>]*>\s*</div>", re.IGNORECASE
+)
+NOSCRIPT_NOTICE = re.compile(
+    r"<noscript\b[^>]*>[^<]*(enable|requires?) javascript", re.IGNORECASE
+)
 
-            # if not "text/javascript" in html:
-            return html
-    return None
+# Requests the browser does not need to render the text of a page.
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media"}
+BLOCKED_HOSTS = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "googlesyndication.com",
+    "facebook.net",
+    "connect.facebook.com",
+    "hotjar.com",
+    "segment.io",
+    "scorecardresearch.com",
+    "adservice.google.com",
+)
 
+http_session: Optional[aiohttp.ClientSession] = None
+
+
+def visible_text_length(html: str) -> int:
+    text = TAGS.sub(" ", HIDDEN_ELEMENTS.sub(" ", html))
+    return len(" ".join(text.split()))
+
+
+def looks_like_js_shell(html: str) -> bool:
+    text_length = visible_text_length(html)
+    if text_length < MIN_STATIC_TEXT:
+        return True
+    return text_length < SHELL_MAX_TEXT and bool(
+        EMPTY_MOUNT_POINT.search(html) or NOSCRIPT_NOTICE.search(html)
+    )
+
+
+async def fetch_check_js(url) -> Optional[str]:
+    """The page's HTML from a plain HTTP fetch, or None when it needs a browser to render."""
+
+    try:
+        async with http_session.get(  # type: ignore
+            url, timeout=aiohttp.ClientTimeout(total=STATIC_FETCH_TIMEOUT)
+        ) as response:
+            if response.status != 200 or response.content_type not in (
+                "text/html",
+                "application/xhtml+xml",
+            ):
+                return None
+            html = await response.text(errors="replace")
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return None
+    if looks_like_js_shell(html):
+        return None
+    return html
+
+
+class ScrapeStats:
+    """How many scrapes took the static fast path or needed the browser, and how long each took."""
+
+    def __init__(self) -> None:
+        self.count = {"static": 0, "browser": 0}
+        self.seconds = {"static": 0.0, "browser": 0.0}
+        self.blocked_requests = 0
+
+    def record(self, renderer: str, seconds: float):
+        self.count[renderer] += 1
+        self.seconds[renderer] += seconds
+
+    def mean(self, renderer: str) -> float:
+        return self.seconds[renderer] / self.count[renderer] if self.count[renderer] else 0.0
+
+    def summary(self) -> dict:
+        total = sum(self.count.values())
+        # What the static scrapes would have cost in the browser. Browser
+        # scrapes are timed including the static attempt before them, so
+        # this is an upper bound.
+        saved = self.count["static"] * (self.mean("browser") - self.mean("static"))
+        return {
+            "static": self.count["static"],
+            "browser": self.count["browser"],
+            "static_ratio": self.count["static"] / total if total else 0.0,
+            "static_mean_ms": round(self.mean("static") * 1000, 1),
+            "browser_mean_ms": round(self.mean("browser") * 1000, 1),
+            "estimated_seconds_saved": round(max(saved, 0.0), 1),
+            "blocked_requests": self.blocked_requests,
+        }
+
+
+class PooledBrowser:
+    def __init__(self, browser: Browser) -> None:
+        self.browser = browser
+        self.active = 0
+        self.served = 0
+        self.retiring = False
+
+
+class BrowserPool:
+    """Warm headless Firefox browsers shared by every request.
+
+    Each request gets a fresh context, so cookies and storage never leak
+    between pages, on the least busy browser. Browsers are retired after a
+    number of pages or when memory grows, and closed once their last page
+    is done; a replacement is launched right away.
+    """
+
+    def __init__(
+        self,
+        size: int = BROWSER_POOL_SIZE,
+        pages_per_browser: int = BROWSER_PAGES,
+        recycle_pages: int = BROWSER_RECYCLE_PAGES,
+        recycle_mb: int = BROWSER_RECYCLE_MB,
+        memory_interval: float = BROWSER_MEMORY_INTERVAL,
+    ) -> None:
+        self.size = size
+        self.capacity = size * pages_per_browser
+        self.recycle_pages = recycle_pages
+        self.recycle_mb = recycle_mb
+        self.memory_interval = memory_interval
+        self.memory_mb = 0.0
+        self.playwright: Optional[Playwright] = None
+        self.browsers: list[PooledBrowser] = []
+        self.slots = asyncio.Semaphore(self.capacity)
+        self.waits: deque[float] = deque(maxlen=WAIT_SAMPLES)
+        self.waiting = 0
+        self.served = 0
+        self.recycled = 0
+        self.timeouts = 0
+        self.tasks: set[asyncio.Task] = set()
+
+    async def start(self):
+        self.playwright = await async_playwright().start()
+        self.browsers = list(
+            await asyncio.gather(*(self.launch() for _ in range(self.size)))
+        )
+        self.spawn(self.sample_memory())
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(
+            *(entry.browser.close() for entry in self.browsers),
+            return_exceptions=True,
+        )
+        self.browsers = []
+        if self.playwright is not None:
+            await self.playwright.stop()
+            self.playwright = None
+
+    async def launch(self) -> PooledBrowser:
+        browser = await self.playwright.firefox.launch(headless=True)  # type: ignore
+        return PooledBrowser(browser)
+
+    @staticmethod
+    def browsers_memory_mb() -> float:
+        """Resident memory of the browser processes, which are children of this one."""
+        rss = 0
+        for child in psutil.Process().children(recursive=True):
+            try:
+                rss += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return rss / 2**20
+
+    async def sample_memory(self):
+        """Keeps `memory_mb` current, scanning the processes off the event loop."""
+        while True:
+            try:
+                self.memory_mb = await asyncio.to_thread(self.browsers_memory_mb)
+            except Exception as e:
+                logger.warning(f"Sampling browser memory failed: {e!r}")
+            await asyncio.sleep(self.memory_interval)
+
+    def spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def retire(self, entry: PooledBrowser):
+        """Stops handing out `entry` and launches its replacement in the background."""
+        if entry.retiring:
+            return
+        entry.retiring = True
+        self.recycled += 1
+        self.spawn(self.replace(entry))
+
+    async def replace(self, entry: PooledBrowser):
+        self.browsers.append(await self.launch())
+        await self.close_if_idle(entry)
+
+    async def close_if_idle(self, entry: PooledBrowser):
+        if entry.active or not entry.retiring or entry not in self.browsers:
+            return
+        # Keep at least one browser until the replacement is up.
+        if any(not e.retiring and e.browser.is_connected() for e in self.browsers):
+            self.browsers.remove(entry)
+            try:
+                await entry.browser.close()
+            except Exception as e:
+                logger.warning(f"Closing a retired browser failed: {e!r}")
+
+    def pick(self) -> PooledBrowser:
+        """Least busy browser; a retiring one only while its replacement is starting."""
+        connected = [entry for entry in self.browsers if entry.browser.is_connected()]
+        live = [entry for entry in connected if not entry.retiring] or connected
+        if not live:
+            raise RuntimeError("No browser is running")
+        return min(live, key=lambda entry: entry.active)
+
+    @asynccontextmanager
+    async def page(self):
+        start = time.perf_counter()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.slots.acquire(), POOL_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.waiting -= 1
+        self.waits.append(time.perf_counter() - start)
 
-@asynccontextmanager
-async def launch_browser():
-    async with async_playwright() as p:
-        browser = await p.firefox.launch(headless=True)
         try:
-            yield browser
+            for entry in self.browsers:
+                if not entry.browser.is_connected():
+                    self.retire(entry)
+            entry = self.pick()
+            entry.active += 1
+            try:
+                context = await entry.browser.new_context()
+                try:
+                    yield await context.new_page()
+                finally:
+                    await context.close()
+            finally:
+                entry.active -= 1
+                entry.served += 1
+                self.served += 1
+                # Under memory pressure the browser that has served the most
+                # pages goes first: it is the one most likely to have grown.
+                # The sample can be up to `memory_interval` old, so only one
+                # browser is retired for memory at a time.
+                if entry.served >= self.recycle_pages or (
+                    self.memory_mb > self.recycle_mb
+                    and not any(e.retiring for e in self.browsers)
+                    and entry is max(self.browsers, key=lambda e: e.served)
+                ):
+                    self.retire(entry)
+                await self.close_if_idle(entry)
         finally:
-            await browser.close()
+            self.slots.release()
+
+    def metrics(self) -> dict:
+        in_use = sum(entry.active for entry in self.browsers)
+        waits = sorted(self.waits)
+        percentile = lambda q: round(waits[int(len(waits) * q)] * 1000, 2) if waits else 0.0
+        return {
+            "browsers": len(self.browsers),
+            "capacity": self.capacity,
+            "in_use": in_use,
+            "utilization": in_use / self.capacity,
+            "waiting": self.waiting,
+            "wait_p50_ms": percentile(0.5),
+            "wait_p95_ms": percentile(0.95),
+            "pages_served": self.served,
+            "pool_timeouts": self.timeouts,
+            "browsers_recycled": self.recycled,
+            "browsers_memory_mb": round(self.memory_mb, 1),
+        }
+
+
+pool = BrowserPool()
+stats = ScrapeStats()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global http_session
+    http_session = aiohttp.ClientSession()
+    await pool.start()
+    yield
+    await pool.stop()
+    await http_session.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+async def block_resources(route: Route):
+    request = route.request
+    host = urlsplit(request.url).hostname or ""
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or any(
+        host == blocked or host.endswith("." + blocked) for blocked in BLOCKED_HOSTS
+    ):
+        stats.blocked_requests += 1
+        await route.abort()
+    else:
+        await route.continue_()
 
 
 async def scrape_with_browser(url: str):
-    async with launch_browser() as browser:
-        page = await browser.new_page()
+    async with pool.page() as page:
+        await page.route("**/*", block_resources)
         await page.goto(url, timeout=2000)
         html = await page.content()
     return html
@@ -40,11 +352,25 @@ async def scrape_with_browser(url: str):
 
 @app.post("/scrape")
 async def scrape_url(url: str):
+    start = time.perf_counter()
+    html = await fetch_check_js(url)
+    if html is not None:
+        stats.record("static", time.perf_counter() - start)
+        return {"html": html, "renderer": "static"}
+
     try:
         html = await scrape_with_browser(url)
     except TimeoutError:
         raise HTTPException(status_code=408, detail="Not fast enough")
-    return {"html": html}
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="No browser available")
+    stats.record("browser", time.perf_counter() - start)
+    return {"html": html, "renderer": "browser"}
+
+
+@app.get("/metrics")
+async def metrics():
+    return {**pool.metrics(), "scrapes": stats.summary()}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,16 @@
+import os
+import pathlib
+import sys
+
+# The orchestrator is run from its own folder and imports its modules as
+# top-level packages; search.py reads its settings at import time.
+sys.path.insert(0, str(pathlib.Path(__file__).parents[1] / "src" / "orchestrator"))
+for name in (
+    "GOOGLE_API_HOST",
+    "GOOGLE_API_KEY",
+    "GOOGLE_CX",
+    "GOOGLE_FIELDS",
+    "HEADER_ACCEPT_ENCODING",
+    "HEADER_USER_AGENT",
+):
+    os.environ.setdefault(name, "test")
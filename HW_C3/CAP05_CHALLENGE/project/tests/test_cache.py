@@ -0,0 +1,77 @@
+import asyncio
+
+import redis.asyncio
+
+from models.document import Document
+from retrieval.cache import INDEX_NAME, IndexConfig, RedisVectorCache
+
+
+def make_cache() -> RedisVectorCache:
+    cache = RedisVectorCache.__new__(RedisVectorCache)
+    cache.client = redis.asyncio.Redis()
+    return cache
+
+
+def test_get_insertables_queues_knn_probes_on_the_async_pipeline(monkeypatch):
+    queued = []
+
+    async def execute(pipeline, raise_on_error=True):
+        queued.extend(command[0] for command in pipeline.command_stack)
+        # Raw FT.SEARCH replies: the first probe finds a near duplicate,
+        # the second finds nothing.
+        return [
+            [1, b"chunks:a", [b"vector_score", b"0.01"]],
+            [0],
+        ]
+
+    monkeypatch.setattr(redis.asyncio.client.Pipeline, "execute", execute)
+    documents = [
+        Document(text="cached", url="u", vector=[1.0, 0.0], similarity=0),
+        Document(text="new", url="u", vector=[0.0, 1.0], similarity=0),
+    ]
+
+    insertables = asyncio.run(make_cache().get_insertables(documents))
+
+    assert [args[0] for args in queued] == ["FT.SEARCH", "FT.SEARCH"]
+    assert [document.text for document in insertables] == ["new"]
+
+
+def test_find_similar_sends_the_configured_ef_runtime(monkeypatch):
+    sent = []
+
+    async def execute_command(client, *args, **options):
+        sent.append(args)
+        return [0]
+
+    monkeypatch.setattr(redis.asyncio.Redis, "execute_command", execute_command)
+    cache = make_cache()
+    cache.index_config = IndexConfig(algorithm="HNSW", ef_runtime=64)
+
+    asyncio.run(cache.find_similar([1.0, 0.0]))
+    asyncio.run(cache.find_similar([1.0, 0.0], ef_runtime=128))
+    cache.index_config = IndexConfig(algorithm="FLAT", ef_runtime=64)
+    asyncio.run(cache.find_similar([1.0, 0.0]))
+
+    queries = [args[2] for args in sent]
+    assert "EF_RUNTIME 64" in queries[0]
+    assert "EF_RUNTIME 128" in queries[1]
+    assert "EF_RUNTIME" not in queries[2]
+
+
+def test_migrate_index_drops_the_legacy_json_index_with_its_documents(monkeypatch):
+    sent = []
+
+    async def execute_command(client, *args, **options):
+        sent.append(args)
+        if args[0] == "FT.INFO":
+            # INDEX_NAME is still the legacy index, not an alias.
+            return ["index_name", args[1], "indexing", "0", "percent_indexed", "1"]
+        return "OK"
+
+    monkeypatch.setattr(redis.asyncio.Redis, "execute_command", execute_command)
+    config = IndexConfig()
+
+    asyncio.run(make_cache().migrate_index(4, config))
+
+    assert ("FT.DROPINDEX", INDEX_NAME, "DD") in sent
+    assert ("FT.ALIASADD", INDEX_NAME, config.index_name) in sent
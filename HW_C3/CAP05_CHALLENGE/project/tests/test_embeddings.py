@@ -0,0 +1,39 @@
+import asyncio
+
+from retrieval.embeddings import CachedEmbeddings, Embeddings, EmbeddingDispatcher
+
+
+class FixedEmbeddings(Embeddings):
+    model = "fixed"
+    vector_dimension = 2
+
+    def __init__(self):
+        self.calls = 0
+
+    async def run(self, chunks):
+        self.calls += 1
+        return [[1.0, 0.0] for _ in chunks]
+
+
+def test_cached_batches_do_not_wait_for_the_batch_limit():
+    async def scenario():
+        backend = FixedEmbeddings()
+        cached = CachedEmbeddings(backend)
+        dispatcher = EmbeddingDispatcher(cached, concurrency=1)
+        await cached.run(["seen"])
+
+        # Every slot is taken, as if other requests' batches were in flight.
+        await dispatcher.semaphore.acquire()
+        hit = await asyncio.wait_for(dispatcher.run(["seen"]), timeout=1)
+        miss = asyncio.create_task(dispatcher.run(["new"]))
+        await asyncio.sleep(0.05)
+        waiting = not miss.done()
+        dispatcher.semaphore.release()
+        await miss
+        return hit, waiting, backend.calls
+
+    hit, waiting, calls = asyncio.run(scenario())
+
+    assert hit == [[1.0, 0.0]]
+    assert waiting
+    assert calls == 2
@@ -0,0 +1,55 @@
+import asyncio
+from types import SimpleNamespace
+
+from retrieval.scraper import ScraperLocal, decode_body, extract_text
+
+
+class StubContent:
+    def __init__(self, body: bytes):
+        self.body = body
+
+    async def iter_chunked(self, size):
+        for start in range(0, len(self.body), size):
+            yield self.body[start : start + size]
+
+
+def read_text(body: bytes, charset=None) -> str:
+    response = SimpleNamespace(charset=charset, content=StubContent(body))
+    return asyncio.run(ScraperLocal().read_text(response))
+
+
+def test_extract_text_keeps_article_header():
+    body = "<article><header><h1>Title</h1></header><p>Body text</p></article>"
+
+    assert extract_text(body) == "Title Body text"
+
+
+def test_extract_text_keeps_page_wide_form():
+    body = (
+        '<body><form id="aspnetForm"><nav>Menu</nav>'
+        "<p>Page content</p><script>var x;</script></form></body>"
+    )
+
+    assert extract_text(body) == "Page content"
+
+
+def test_read_text_honours_meta_charset_without_header_charset():
+    body = (
+        "<html><head><meta charset=iso-8859-1></head>"
+        "<body><p>Canción de la niña en Ávila</p></body></html>"
+    ).encode("latin-1")
+
+    assert "Canción de la niña en Ávila" in read_text(body)
+
+
+def test_read_text_uses_the_header_charset():
+    body = "<p>Canción de la niña</p>".encode("utf-8")
+
+    assert read_text(body, charset="utf-8") == "<p>Canción de la niña</p>"
+
+
+def test_decode_body_detects_undeclared_encodings():
+    text = "<p>La canción de la niña en Ávila, año tras año, con señales.</p>"
+
+    assert decode_body(text.encode("utf-8")) == text
+    assert decode_body(text.encode("latin-1")) == text